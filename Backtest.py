@@ -0,0 +1,147 @@
+import calendar
+from datetime import datetime
+from multiprocessing import Pool, cpu_count
+from time import strptime
+import numpy as np
+from Matching import FixtureMatcher, by_kickoff
+from OddsHistory import OddsHistory
+from Settlement import BetBook, MONEYLINE, SPREAD, TYPES
+
+_DATE_FORMAT = '%Y-%m-%d-%H:%M'
+
+def fixture_results(history, fixtures, aliases, accept=0.85):
+    """
+    Results of the recorded events found among finished fixtures, by known team aliases or a confident
+    n-gram match, never asking
+    :param history: OddsHistory
+    :param fixtures: finished fixtures, as kept by FixtureStore
+    :param aliases: AliasIndex
+    :return: dict<event key, (home goals, away goals)>
+    """
+    times = {}
+    for info in history.events:
+        times.setdefault(datetime.strptime(info['time'], _DATE_FORMAT), []).append(info)
+    matcher = FixtureMatcher(by_kickoff(fixtures, set(times)), aliases, accept=accept)
+    results = {}
+    for mtime, infos in times.items():
+        for info in infos:
+            f = matcher.known(mtime, info['teams']) or matcher.auto(matcher.candidates(mtime, info['teams']))
+            if f is not None:
+                results[info['key']] = (f['result']['goalsHomeTeam'], f['result']['goalsAwayTeam'])
+    return results
+
+def market_table(history, results, closing=True):
+    """
+    Odds rows of the matches with a known result, taken before kick off
+    :param history: OddsHistory
+    :param results: dict<event key, (home goals, away goals)>
+    :param closing: keep only the last row of each market (closing line)
+    :return: dict<column, array> - time, event, market, line, odds (n, 3), kickoff, home, away
+        odds are rounded back to the 3 decimals of toOdds
+    """
+    cols = history.columns()
+    ids = np.array([i for i, info in enumerate(history.events) if info['key'] in results], dtype=np.int64)
+    kickoff = np.zeros(len(history.events), dtype=np.int64)
+    goals = np.zeros((len(history.events), 2))
+    for i in ids:
+        info = history.events[i]
+        kickoff[i] = calendar.timegm(strptime(info['time'], _DATE_FORMAT))
+        goals[i] = results[info['key']]
+    event = np.asarray(cols['event'], dtype=np.int64)
+    sel = np.in1d(event, ids)
+    sel[sel] = cols['time'][sel] < kickoff[event[sel]]
+    sel = np.nonzero(sel)[0]
+    if closing and len(sel):
+        ident = event[sel] * 4 + cols['market'][sel]
+        _, last = np.unique(ident[::-1], return_index=True)
+        sel = np.sort(sel[len(sel) - 1 - last])
+    ev = event[sel]
+    return {'time': np.asarray(cols['time'][sel]), 'event': ev, 'market': np.asarray(cols['market'][sel]),
+            'line': np.asarray(cols['line'][sel], dtype=float), 'odds': np.round(np.asarray(cols['odds'][sel], dtype=float), 3),
+            'kickoff': kickoff[ev], 'home': goals[ev, 0], 'away': goals[ev, 1]}
+
+def _subevent(kind, line, odds, stake, side):
+    if kind == MONEYLINE:
+        odds = list(odds)
+    elif kind == SPREAD:
+        odds = [[line, odds[0]], [-line, odds[1]]]
+    else:
+        odds = [line, [odds[0], odds[1]]]
+    return {'type': TYPES[kind], 'odds': odds, 'bets': [(stake, side)]}
+
+class Backtest(object):
+    """
+    Replay a market table through staking strategies, settled with the Moneyline / Spread / TotalGoals rules
+    Constructor:
+    :param table: dict of arrays from market_table
+    :param bankroll: starting balance
+    """
+
+    def __init__(self, table, bankroll=10000):
+        self.table = table
+        self.bankroll = bankroll
+
+    def run(self, strategy, params=None):
+        """
+        :param strategy: callable(table, **params) -> (row indexes, sides, stakes)
+            side - 1 / 0 / -1 for moneyline home / draw / away, 1 / -1 home / away or over / under otherwise
+        :param params: keyword arguments of the strategy
+        :return: dict - curve (balance after each bet, by kick off), bets, staked, profit, roi, hit_rate, max_drawdown
+        """
+        t = self.table
+        idx, side, stake = [np.asarray(a) for a in strategy(t, **(params or {}))]
+        if not len(idx):
+            return {'curve': np.zeros(0), 'bets': 0, 'staked': 0.0, 'profit': 0.0, 'roi': 0.0,
+                    'hit_rate': 0.0, 'max_drawdown': 0.0}
+        book = BetBook([_subevent(t['market'][i], t['line'][i], t['odds'][i], float(s), int(d))
+                        for i, d, s in zip(idx, side, stake)])
+        pay = book.payouts(t['home'][idx][book.owner], t['away'][idx][book.owner])
+        pnl = np.bincount(book.owner, weights=pay, minlength=len(book)) - book.stakes()
+        order = np.argsort(t['kickoff'][idx], kind='mergesort')
+        curve = self.bankroll + np.cumsum(pnl[order])
+        peak = np.maximum.accumulate(np.concatenate([[self.bankroll], curve]))[1:]
+        staked = float(np.sum(stake))
+        return {'curve': curve,
+                'bets': len(idx),
+                'staked': staked,
+                'profit': float(curve[-1] - self.bankroll),
+                'roi': staked and float(curve[-1] - self.bankroll) / staked or 0.0,
+                'hit_rate': float(np.mean(pnl > 0)),
+                'max_drawdown': float(np.max(peak - curve))}
+
+_BACKTEST = None
+
+def _init(root, results, bankroll, closing):
+    global _BACKTEST
+    _BACKTEST = Backtest(market_table(OddsHistory(root), results, closing), bankroll)
+
+def _run(job):
+    strategy, params = job
+    return params, _BACKTEST.run(strategy, params)
+
+def grid_search(root, results, strategy, grid, bankroll=10000, closing=True, processes=None):
+    """
+    Run a strategy over many parameter sets on a process pool, each worker maps the odds history once
+    :param root: OddsHistory directory
+    :param results: dict<event key, (home goals, away goals)>
+    :param strategy: module level callable, see Backtest.run
+    :param grid: list of parameter dicts
+    :return: list<(params, stats)> in grid order
+    """
+    processes = processes or cpu_count()
+    pool = Pool(processes, _init, (root, results, bankroll, closing))
+    try:
+        return pool.map(_run, [(strategy, p) for p in grid], chunksize=max(1, len(grid) / (processes * 4)))
+    finally:
+        pool.close()
+        pool.join()
+
+def favourite(table, max_odds=2.0, stake=100.0):
+    """
+    Example strategy: back the moneyline favourite when its price is at most max_odds
+    """
+    ml = np.nonzero(table['market'] == MONEYLINE)[0]
+    odds = table['odds'][ml][:, [0, 2]]
+    pick = odds.argmin(axis=1)
+    keep = odds[np.arange(len(ml)), pick] <= max_odds
+    return ml[keep], np.where(pick[keep] == 0, 1, -1), np.full(keep.sum(), stake)
@@ -0,0 +1,333 @@
+import BaseHTTPServer
+import SocketServer
+import argparse
+import copy
+import hashlib
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape
+from Events import Moneyline, Spread, TotalGoals
+from Keys import event_key
+from OddsHistory import OddsHistory
+
+_SYLLABLES = ['ar', 'bel', 'cor', 'de', 'fin', 'gal', 'ham', 'la', 'mon', 'nor', 'por', 'ri', 'san', 'ter', 'vil', 'wes']
+_SUFFIXES = ['United', 'City', 'Athletic', 'Rovers', 'Wanderers', 'Sporting']
+_SPORTS = ['Soccer', 'Basketball', 'Tennis', 'Hockey', 'Baseball', 'Football']
+# soccer leagues passing the filter of _CONF, the other leagues of the feed are dropped
+_KEPT = ['Eng. Premier', 'Eng. Football League', 'Spain La Liga', 'Italy Serie A', 'Germany Bundesliga',
+         'Segunda Division', 'USA MLS']
+_PERIODS = ['Match', '1st Half', '2nd Half', '1st Quarter', '2nd Quarter']
+_CONF = {'pref': ['Eng. F', 'Eng. P', 'Segunda', 'USA'], 'repat': ['.*Serie A$', '.*La Liga$', '.*Bundesliga$'],
+         'odds_ttl': 300, 'refresh_every': 10 ** 6, 'match_ask': False}
+_FD_DATE = '%Y-%m-%dT%H:%M:%SZ'
+
+def _team(rng):
+    return '{} {}'.format(''.join([rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 3))]).capitalize(),
+                          rng.choice(_SUFFIXES))
+
+def _american(prob, margin=1.05):
+    """
+    :return: american odds of an outcome of probability prob, with the bookmaker margin
+    """
+    dec = 1.0 / min(prob * margin, 0.95)
+    if dec >= 2:
+        return '{:d}'.format(int(round((dec - 1) * 100)))
+    return '{:d}'.format(-int(round(100 / (dec - 1))))
+
+def _period(rng, num, desc):
+    home = rng.uniform(0.2, 0.6)
+    draw = rng.uniform(0.2, 0.3)
+    line = rng.choice([-1.5, -1.25, -1, -0.75, -0.5, -0.25, 0, 0.25, 0.5, 0.75, 1])
+    total = rng.choice([1.5, 2, 2.25, 2.5, 2.75, 3, 3.5])
+    over = rng.uniform(0.4, 0.6)
+    return ('<period><period_number>{}</period_number><period_description>{}</period_description>'
+            '<period_status>I</period_status><period_update>open</period_update>'
+            '<moneyline><moneyline_visiting>{}</moneyline_visiting><moneyline_home>{}</moneyline_home>'
+            '<moneyline_draw>{}</moneyline_draw></moneyline>'
+            '<spread><spread_visiting>{}</spread_visiting><spread_adjust_visiting>{}</spread_adjust_visiting>'
+            '<spread_home>{}</spread_home><spread_adjust_home>{}</spread_adjust_home></spread>'
+            '<total><total_points>{}</total_points><over_adjust>{}</over_adjust><under_adjust>{}</under_adjust></total>'
+            '</period>').format(num, desc, _american(1 - home - draw), _american(home), _american(draw),
+                                -line, _american(0.5), line, _american(0.5), total, _american(over), _american(1 - over))
+
+class Feeds(object):
+    """
+    Synthetic Pinnacle odds feed, football-data fixtures and rec.bin with pending bets
+    Constructor:
+    :param sports: sport types in the feed, the first one is soccer
+    :param leagues: leagues per sport, up to 7 soccer leagues pass the league filter
+    :param events: events per league
+    :param periods: periods per event, the first one is the match
+    :param fixtures: finished fixtures besides the ones of our bets
+    :param bets: pending bets, on matches finished in the last weeks
+    :param seed: random seed, the same parameters and seed give the same feeds
+    """
+
+    def __init__(self, sports=3, leagues=20, events=30, periods=3, fixtures=2000, bets=200, seed=0):
+        rng = random.Random(seed)
+        now = datetime.utcnow().replace(second=0, microsecond=0)
+        self.events = 0
+        self.odds = self._odds_xml(rng, now, sports, leagues, events, periods)
+        self.etag = '"{}"'.format(hashlib.sha1(self.odds).hexdigest())
+        self.record, fixtures = self._pending(rng, now, bets, fixtures)
+        self.fixtures = json.dumps({'count': len(fixtures), 'fixtures': fixtures})
+
+    def _odds_xml(self, rng, now, sports, leagues, events, periods):
+        parts = ['<?xml version="1.0" encoding="UTF-8"?><pinnacle_line_feed>'
+                 '<PinnacleFeedTime>{}</PinnacleFeedTime><events>'.format(int(time.time() * 1000))]
+        num = 0
+        for s in range(sports):
+            sport = _SPORTS[s % len(_SPORTS)]
+            for l in range(leagues):
+                league = s == 0 and l < len(_KEPT) and _KEPT[l] or '{} League {}'.format(sport, l + 1)
+                for e in range(events):
+                    num += 1
+                    kick = now + timedelta(minutes=rng.randint(30, 14 * 24 * 60))
+                    parts.append('<event><event_datetimeGMT>{:%Y-%m-%d %H:%M}</event_datetimeGMT><gamenumber>{}</gamenumber>'
+                                 '<sporttype>{}</sporttype><league>{}</league><IsLive>No</IsLive><participants>'.format(
+                                     kick, num, sport, escape(league)))
+                    for side in ['Home', 'Visiting']:
+                        parts.append('<participant><participant_name>{}</participant_name><contestantnum>{}</contestantnum>'
+                                     '<visiting_home_draw>{}</visiting_home_draw></participant>'.format(
+                                         escape(_team(rng)), num, side))
+                    parts.append('<participant><participant_name>Draw</participant_name>'
+                                 '<visiting_home_draw>Draw</visiting_home_draw></participant></participants><periods>')
+                    for p in range(periods):
+                        parts.append(_period(rng, p, _PERIODS[p % len(_PERIODS)]))
+                    parts.append('</periods></event>')
+        self.events = num
+        parts.append('</events></pinnacle_line_feed>')
+        return ''.join(parts)
+
+    @staticmethod
+    def _fixture(num, tids, home, away, kick, result):
+        return {'_links': {'self': {'href': 'http://stub/v1/fixtures/{}'.format(num)},
+                           'homeTeam': {'href': 'http://stub/v1/teams/{}'.format(tids.setdefault(home, len(tids) + 1))},
+                           'awayTeam': {'href': 'http://stub/v1/teams/{}'.format(tids.setdefault(away, len(tids) + 1))}},
+                'date': kick.strftime(_FD_DATE), 'status': 'FINISHED', 'matchday': 1,
+                'homeTeamName': home, 'awayTeamName': away,
+                'result': {'goalsHomeTeam': result[0], 'goalsAwayTeam': result[1]}}
+
+    def _pending(self, rng, now, bets, others):
+        """
+        :return: (rec.bin dict, finished fixtures), football-data names of our teams differ now and then
+        """
+        record = {'balance': 10 ** 9, 'match': {}, 'subevent': {}}
+        fixtures = []
+        tids = {}
+        kicks = []
+        matches = []
+        for m in range(max(bets / 2, 1)):
+            teams = [_team(rng), _team(rng)]
+            kick = now - timedelta(days=rng.randint(1, 20), hours=rng.randint(0, 23))
+            kicks.append(kick)
+            mkey = event_key(teams, kick)
+            record['match'][mkey] = {'teams': teams, 'match_time': kick.strftime('%Y-%m-%d-%H:%M'), 'period': 'Match'}
+            matches.append(mkey)
+            theirs = [rng.random() < 0.3 and t + ' FC' or t for t in teams]
+            fixtures.append(self._fixture(len(fixtures), tids, theirs[0], theirs[1], kick,
+                                          (rng.randint(0, 4), rng.randint(0, 4))))
+        for b in range(bets):
+            mkey = rng.choice(matches)
+            base = {'match_key': mkey, 'match_time': record['match'][mkey]['match_time'], 'period': 'Match'}
+            kind = rng.randint(0, 2)
+            if kind == 0:
+                market, side = Moneyline(odds=[round(rng.uniform(1.2, 6), 3) for _ in range(3)], **base), rng.choice([1, 0, -1])
+            elif kind == 1:
+                line = rng.choice([-1, -0.75, -0.5, -0.25, 0, 0.25, 0.5])
+                market = Spread(odds=[(line, round(rng.uniform(1.7, 2.2), 3)), (-line, round(rng.uniform(1.7, 2.2), 3))], **base)
+                side = rng.choice([1, -1])
+            else:
+                market = TotalGoals(goalnum=rng.choice([2, 2.25, 2.5, 2.75]),
+                                    odds=[round(rng.uniform(1.7, 2.2), 3) for _ in range(2)], **base)
+                side = rng.choice([1, -1])
+            sube = record['subevent'].setdefault(market.key(), market.toDict())
+            sube['bets'].append((round(rng.uniform(5, 500), 2), side))
+        for f in range(others):
+            # half of them kick off with one of our matches, so the matcher has to tell them apart
+            kick = rng.random() < 0.5 and rng.choice(kicks) or now - timedelta(days=rng.randint(1, 20), hours=rng.randint(0, 23))
+            fixtures.append(self._fixture(len(fixtures), tids, _team(rng), _team(rng), kick,
+                                          (rng.randint(0, 4), rng.randint(0, 4))))
+        rng.shuffle(fixtures)
+        return record, fixtures
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    GET /odds - the odds feed, honouring If-None-Match
+    GET /v1/fixtures - every fixture, whatever the time frame
+    """
+
+    def do_GET(self):
+        feeds = self.server.feeds
+        if self.path.startswith('/odds'):
+            if self.headers.getheader('If-None-Match') == feeds.etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body, ctype = feeds.odds, 'application/xml'
+        elif self.path.startswith('/v1/fixtures'):
+            body, ctype = feeds.fixtures, 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', feeds.etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+def stub_server(feeds):
+    """
+    Serve the feeds on a free local port from a daemon thread
+    :return: server, call shutdown() when done
+    """
+    server = _Server(('127.0.0.1', 0), _Handler)
+    server.feeds = feeds
+    worker = threading.Thread(target=server.serve_forever, name='Stub')
+    worker.daemon = True
+    worker.start()
+    return server
+
+def _peak_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+class _Stages(object):
+    """
+    Wall time, throughput and peak resident memory of consecutive stages
+    """
+
+    def __init__(self):
+        self.stages = OrderedDict()
+
+    def run(self, name, func, items=None):
+        """
+        :param items: callable(result) -> number of items processed, for the throughput
+        :return: what func returns
+        """
+        devnull = open(os.devnull, 'w')
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            tick = time.time()
+            rtn = func()
+            spent = time.time() - tick
+        finally:
+            sys.stdout = stdout
+            devnull.close()
+        stage = self.stages[name] = OrderedDict([('seconds', round(spent, 6))])
+        if items is not None:
+            stage['items'] = items(rtn)
+            stage['per_second'] = spent and round(stage['items'] / spent, 1) or None
+        stage['peak_rss_kb'] = _peak_kb()
+        return rtn
+
+def run(feeds, factory, root):
+    """
+    Load, match and settle the synthetic feeds in a fresh user directory
+    :param factory: callable(root) -> MainMenu
+    :return: OrderedDict<stage, timings>
+    """
+    server = stub_server(feeds)
+    base = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    conf = dict(_CONF, odds_url=base + '/odds', fd_url=base + '/v1/fixtures')
+    json.dump(conf, open(os.path.join(root, 'conf.json'), 'w'))
+    json.dump(feeds.record, open(os.path.join(root, 'rec.bin'), 'w'))
+    st = _Stages()
+    try:
+        menu = st.run('startup', lambda: factory(root))
+        st.run('background_load', lambda: [e.wait() for e in [menu._bets_ready, menu._results_ready]])
+        # the stages again one by one, on the state the menu just loaded
+        os.remove(menu._odds.path)
+        menu._odds.meta = {}
+        st.run('fetch', lambda: menu._odds.fetch(force=True).close(), lambda _: len(feeds.odds))
+        st.run('revalidate', lambda: menu._odds.fetch(force=True).close())
+        with open(menu._odds.path, 'rb') as fin:
+            st.run('filter', lambda: sum([1 for _ in menu._iter_events(fin)]), lambda _: feeds.events)
+        with open(menu._odds.path, 'rb') as fin:
+            nodes = [copy.deepcopy(e) for _, e in menu._iter_events(fin)]
+        st.run('construct', lambda: [menu._event(e) for e in nodes], len)
+        with open(menu._odds.path, 'rb') as fin:
+            events = st.run('parse', lambda: menu._parse_bets(fin), lambda evs: sum([len(e) for e in evs.values()]))
+        history = OddsHistory(os.path.join(root, 'bench_history'))
+        st.run('odds_history', lambda: history.record(events), lambda rows: rows)
+        menu._fixture_store.synced = menu._fixture_store.covered = None
+        st.run('results_fetch', lambda: menu._fixture_store.sync(menu._fixture_client, 30)[0], lambda n: n)
+        fixtures = menu._fixture_store.finished(datetime.utcnow().date() - timedelta(days=30))
+        st.run('matching', lambda: menu._match_results(fixtures),
+               lambda _: len([m for m in menu.matches.values() if 'result' in m]))
+        pending = len(menu.subevents)
+        st.run('settlement', menu._execute_results, lambda _: pending - len(menu.subevents))
+        st.run('persistence', menu._snapshot, lambda _: st.stages['settlement']['items'])
+        menu._main_after()
+    finally:
+        server.shutdown()
+        server.server_close()
+    return st.stages
+
+def benchmark(feeds, factory, repeat=1):
+    """
+    :return: machine readable baseline, best of `repeat` runs for every stage
+    """
+    best = None
+    for r in range(repeat):
+        root = tempfile.mkdtemp(prefix='betfun-bench-')
+        try:
+            stages = run(feeds, factory, root)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        if best is None:
+            best = stages
+            continue
+        for name, stage in stages.items():
+            if stage['seconds'] < best[name]['seconds']:
+                best[name] = stage
+    return OrderedDict([('python', sys.version.split()[0]), ('when', datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')),
+                        ('feed_bytes', len(feeds.odds)), ('feed_events', feeds.events),
+                        ('fixtures_bytes', len(feeds.fixtures)), ('peak_rss_kb', _peak_kb()), ('stages', best)])
+
+def compare(old, new):
+    print '{:<16}{:>12}{:>12}{:>9}'.format('stage', 'before (s)', 'after (s)', 'ratio')
+    for name, stage in new['stages'].items():
+        before = old['stages'].get(name, {}).get('seconds')
+        ratio = before and '{:.2f}x'.format(stage['seconds'] / before) or '-'
+        print '{:<16}{:>12}{:>12.4f}{:>9}'.format(name, before is None and '-' or '{:.4f}'.format(before),
+                                                  stage['seconds'], ratio)
+
+if __name__ == '__main__':
+    from betfun import MainMenu
+    parser = argparse.ArgumentParser(description='Time the betfun stages on synthetic feeds served locally')
+    parser.add_argument('--sports', type=int, default=3)
+    parser.add_argument('--leagues', type=int, default=20, help='leagues per sport')
+    parser.add_argument('--events', type=int, default=30, help='events per league')
+    parser.add_argument('--periods', type=int, default=3, help='periods per event')
+    parser.add_argument('--fixtures', type=int, default=2000, help='finished fixtures besides the ones of our bets')
+    parser.add_argument('--bets', type=int, default=200, help='pending bets')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=1, help='runs, the best time of each stage is kept')
+    parser.add_argument('-o', '--output', metavar='FILE', help='write the baseline to FILE instead of stdout')
+    parser.add_argument('--compare', metavar='FILE', help='print the ratios against an earlier baseline')
+    args = parser.parse_args()
+    feeds = Feeds(args.sports, args.leagues, args.events, args.periods, args.fixtures, args.bets, args.seed)
+    result = benchmark(feeds, lambda root: MainMenu(root), args.repeat)
+    result['params'] = {k: getattr(args, k) for k in ['sports', 'leagues', 'events', 'periods', 'fixtures', 'bets', 'seed']}
+    if args.output:
+        json.dump(result, open(args.output, 'w'), indent=2)
+    elif not args.compare:
+        print json.dumps(result, indent=2)
+    if args.compare:
+        compare(json.load(open(args.compare, 'r')), result)
@@ -4,6 +4,7 @@ import math
 from collections import Counter
 from datetime import datetime
 import re
+from Keys import event_key, market_key
 
 _DATE_FORMAT = '%Y-%m-%d-%H:%M'
 
@@ -40,6 +41,10 @@ def toOdds(*mls):
     return rtn
 
 class AbstractBetType(object):
+    # many thousands of markets are alive when every league is loaded, so no instance __dict__
+    __slots__ = ('time', '_ekey', 'period', 'bets', '_key')
+    name = 'Abstract Bet'
+
     def __init__(self, match_time, match_key, period, **kwargs):
         """
         Abstract bet type
@@ -48,18 +53,21 @@ class AbstractBetType(object):
         :param match_key: bet event key
         :param kwargs:
         """
-        self.name = 'Abstract Bet'
         self.time = isinstance(match_time, str) and datetime.strptime(match_time, _DATE_FORMAT) or match_time
         # self.teams = bteams
         self._ekey = str(match_key)
+        self._key = None
         self.period = period
         self.bets = []
         if 'bets' in kwargs:
             for l in kwargs['bets']:
                 self.doBet(*l)
-        self.total_bet = sum([t[0] for t in self.bets])
         # self.odds = []
 
+    @property
+    def total_bet(self):
+        return sum([t[0] for t in self.bets])
+
     def __str__(self):
         raise NotImplementedError
 
@@ -76,12 +84,22 @@ class AbstractBetType(object):
         raise NotImplementedError
 
     def key(self):
-        return str(hash(self._ekey) & 31) + self.bkey()
+        if self._key is None:
+            self._key = market_key(self._ekey, self.bkey())
+        return self._key
 
     def bet_details(self):
-        return [(bet, '{1} @ {0}'.format(*self.odds_str(subev))) for bet, subev in self.bets]
+        return self.details(self.odds, self.bets)
+
+    @classmethod
+    def details(cls, odds, bets):
+        return [(bet, '{1} @ {0}'.format(*cls._odds_str(odds, subev))) for bet, subev in bets]
 
     def odds_str(self, subev):
+        return self._odds_str(self.odds, subev)
+
+    @staticmethod
+    def _odds_str(odds, subev):
         raise NotImplementedError
 
     def toDict(self):
@@ -94,6 +112,9 @@ class AbstractBetType(object):
 
 
 class Moneyline(AbstractBetType):
+    __slots__ = ('odds',)
+    name = 'Moneyline'
+
     def __init__(self, odds, **kwargs):
         """
         Moneyline - regular W - D - L
@@ -104,8 +125,6 @@ class Moneyline(AbstractBetType):
         """
         self.odds = odds
         super(Moneyline, self).__init__(**kwargs)
-        self.name = 'Moneyline'
-
 
     @staticmethod
     def catagorization(h, a, *others):
@@ -121,8 +140,9 @@ class Moneyline(AbstractBetType):
         return sum([ (subev == tsubev) and self.odds[(1-tsubev)] * bet or 0
                      for bet, subev in self.bets ])  # 1 - tsubev = 0, 1, 2 respectively
 
-    def odds_str(self, subev):
-        return zip(self.odds, ['Win', 'Draw', 'Lose'])[1-subev]
+    @staticmethod
+    def _odds_str(odds, subev):
+        return zip(odds, ['Win', 'Draw', 'Lose'])[1-subev]
 
     def bkey(self):
         return 'M' + ''.join(['{:.2f}'.format(o) for o in self.odds])
@@ -131,6 +151,9 @@ class Moneyline(AbstractBetType):
         return '  '.join([_podd(o, 4) for o in self.odds])
 
 class Spread(AbstractBetType):
+    __slots__ = ('odds',)
+    name = 'Spread'
+
     def __init__(self, odds, **kwargs):
         """
         Spread play - +1, +1.25, ...
@@ -139,10 +162,7 @@ class Spread(AbstractBetType):
         sub event - 1 Home, -1 Away
         """
         self.odds = odds
-        self._bets = []
         super(Spread, self).__init__(**kwargs)
-        self.name = 'Spread'
-
 
     @staticmethod
     def catagorization(adjust, h, a, *others):
@@ -151,31 +171,36 @@ class Spread(AbstractBetType):
     def execute(self, results):
         return sum([ ((Spread.catagorization(adj, *results) == subev) and bet * self.odds[int(0.5-subev)][1] or 0 ) +
                      ((Spread.catagorization(adj, *results) == 0) and bet or 0)
-                       for bet, adj, subev in self._bets])
+                       for bet, adj, subev in self._split()])
 
     def bkey(self):
         return 'S'+ ''.join(['{:d}{:.2f}'.format(int(o[0] * 4), o[1]) for o in self.odds])
 
-    def odds_str(self, subev):
-        odd, opt = zip(self.odds, ['Home', 'Away'])[int(0.5-subev)]
+    @staticmethod
+    def _odds_str(odds, subev):
+        odd, opt = zip(odds, ['Home', 'Away'])[int(0.5-subev)]
         return (odd[1], '{} ({:+}) Win'.format(opt, odd[0]))
 
     def __str__(self):
         return '  '.join(['{:<7}{}'.format('({:+})'.format(o[0]), _podd(o[1],4)) for o in self.odds])
 
-    def doBet(self, bet, sub_event):
+    def _split(self):
         """
-        bet tuple: $bet, adjust, sub_event
+        bet tuples: $bet, adjust, sub_event - quarter lines are half on each neighbour line
         """
-        super(Spread, self).doBet(bet, sub_event)
-        adj = self.odds[int(0.5-sub_event)][0] * sub_event
-        if int(adj*4) & 1:
-            self._bets.append((bet/2.0, adj+0.25, sub_event))
-            self._bets.append((bet/2.0, adj-0.25, sub_event))
-        else:
-            self._bets.append((bet, adj, sub_event))
+        rtn = []
+        for bet, sub_event in self.bets:
+            adj = self.odds[int(0.5-sub_event)][0] * sub_event
+            if int(adj*4) & 1:
+                rtn.append((bet/2.0, adj+0.25, sub_event))
+                rtn.append((bet/2.0, adj-0.25, sub_event))
+            else:
+                rtn.append((bet, adj, sub_event))
+        return rtn
 
 class TotalGoals(AbstractBetType):
+    __slots__ = ('odds', 'goalnum', '_odds')
+    name = 'TotalGoals'
 
     def __init__(self, odds, **kwargs):
         """
@@ -194,21 +219,23 @@ class TotalGoals(AbstractBetType):
         else:
             self.goalnum = odds[0]
             self._odds = odds[1]
-        self._bets = []
         super(TotalGoals, self).__init__(**kwargs)
-        self.name = 'TotalGoals'
 
+    def _split(self):
+        """
+        bet tuples: $bet, goal line, sub_event - quarter lines are half on each neighbour line
+        """
+        if not int(self.goalnum * 4) & 1:
+            return [(bet, self.goalnum, sub_event) for bet, sub_event in self.bets]
+        rtn = []
+        for bet, sub_event in self.bets:
+            rtn.append((bet / 2.0, self.goalnum + 0.25, sub_event))
+            rtn.append((bet / 2.0, self.goalnum - 0.25, sub_event))
+        return rtn
 
-    def doBet(self, bet, sub_event):
-        super(TotalGoals, self).doBet(bet, sub_event)
-        if int(self.goalnum * 4) & 1:
-            self._bets.append((bet / 2.0, self.goalnum + 0.25, sub_event))
-            self._bets.append((bet / 2.0, self.goalnum - 0.25, sub_event))
-        else:
-            self._bets.append((bet, self.goalnum, sub_event))
-
-    def odds_str(self, subev):
-        return zip(self.odds[1], ['{} {}'.format(s, self.odds[0]) for s in ['Over', 'Under']])[int(0.5 - subev)]
+    @staticmethod
+    def _odds_str(odds, subev):
+        return zip(odds[1], ['{} {}'.format(s, odds[0]) for s in ['Over', 'Under']])[int(0.5 - subev)]
 
     def bkey(self):
         return 'T' + ''.join(['{:d}{:.2f}'.format(int(self.goalnum * 4), o) for o in self._odds])
@@ -217,12 +244,13 @@ class TotalGoals(AbstractBetType):
         rgoal = sum(results)
         return sum([(((rgoal - goal) / subev > 0) and bet * self._odds[int(0.5 - subev)] or 0) +
                     ((rgoal == goal) and bet or 0)
-                    for bet, goal, subev in self._bets])
+                    for bet, goal, subev in self._split()])
 
     def __str__(self):
         return '{1} (+{0:^6}-) {2}'.format(self.goalnum, *[_podd(o, 4) for o in self._odds])
 
-class BetEvent:
+class BetEvent(object):
+    __slots__ = ('teams', 'deadline', 'period', 'moneyline', 'spread', 'total', '_row', '_key')
 
     def __init__(self, teams_rel, ddl, opens):
         """
@@ -233,29 +261,50 @@ class BetEvent:
         """
         self.teams = tuple(teams_rel)
         self.deadline = ddl
-        self._bkwargs = {
-            'match_time': self.deadline,
-            'bteams': self.teams,
-            'match_key': self.key(),
-            'period': opens.find('period_description').text
-        }
+        self._key = event_key(self.teams, self.deadline)
+        self._row = None
+        self.period = opens.find('period_description').text
+        bkwargs = {'match_time': self.deadline, 'match_key': self.key(), 'period': self.period}
         if opens.find('moneyline') is not None:
             self.moneyline = Moneyline(odds=toOdds(*[opens.find('moneyline').find(t).text
-                             for t in ['moneyline_home', 'moneyline_draw', 'moneyline_visiting']]), **self._bkwargs)
+                             for t in ['moneyline_home', 'moneyline_draw', 'moneyline_visiting']]), **bkwargs)
         if opens.find('spread') is not None:
             self.spread = Spread(odds=[
                 (float(opens.find('spread').find('spread_%s' % t).text),
-                 toOdds(opens.find('spread').find('spread_adjust_%s' % t).text)[0]) for t in 'home', 'visiting'], **self._bkwargs)
+                 toOdds(opens.find('spread').find('spread_adjust_%s' % t).text)[0]) for t in 'home', 'visiting'], **bkwargs)
         if opens.find('total') is not None:
             self.total = TotalGoals(goalnum=float(opens.find('total').find('total_points').text),
                                     odds=toOdds([opens.find('total').find(t).text
-                                                 for t in ['over_adjust', 'under_adjust']]), **self._bkwargs)
+                                                 for t in ['over_adjust', 'under_adjust']]), **bkwargs)
+
+    def update(self, other):
+        """
+        Take the markets of a newer copy of the same event, keeping the unchanged ones
+        :param other: BetEvent with the same key
+        :return: number of markets replaced, added or removed
+        """
+        changed = 0
+        for t in ['moneyline', 'spread', 'total']:
+            mine, theirs = getattr(self, t, None), getattr(other, t, None)
+            if theirs is None:
+                if mine is not None:
+                    delattr(self, t)
+                    changed += 1
+            elif mine is None or mine.key() != theirs.key():
+                setattr(self, t, theirs)
+                changed += 1
+        if changed:
+            self._row = None
+        return changed
 
     def name(self):
         return ' - '.join(self.teams)
 
     def __str__(self):
-        return '    '.join([str(getattr(self, t, ' '*l)) for t,l in zip(['moneyline','spread','total'], [19,26,22])])
+        # rendered once, markets are only replaced through update
+        if self._row is None:
+            self._row = '    '.join([str(getattr(self, t, ' '*l)) for t,l in zip(['moneyline','spread','total'], [19,26,22])])
+        return self._row
 
     def __len__(self):
         return len(self.name())
@@ -270,19 +319,10 @@ class BetEvent:
         b = ''.join(other.teams)
         return (a < b) and -1 or ((a > b) and 1 or 0)
 
-    @staticmethod
-    def _teamkey(teams):
-        return ''.join([str(hash(tm) & 65535) + _abbr(tm) for tm in teams])
-
-    @staticmethod
-    def _timekey(st_time):
-        # return '{0.tm_year}{0.tm_mon:0>2}{0.tm_mday:0>2}{0.tm_hour:0>2}{0.tm_min:0>2}'.format(st_time)
-        return st_time.strftime('%Y%m%d%H%M')
-
     def key(self):
-        return BetEvent._timekey(self.deadline) + BetEvent._teamkey(self.teams)
+        return self._key
 
     def toDict(self):
         return {'teams': self.teams,
                 'match_time': self.deadline.strftime(_DATE_FORMAT),
-                'period': self._bkwargs['period']}
\ No newline at end of file
+                'period': self.period}
\ No newline at end of file
@@ -0,0 +1,126 @@
+import math
+import numpy as np
+from Settlement import BetBook
+
+def poisson_pmf(rates, goals=11):
+    """
+    Goal probabilities of Poisson rates, the last column absorbs the tail
+    :param rates: array of goal rates
+    :return: array (len(rates), goals)
+    """
+    rates = np.asarray(rates, dtype=float)
+    k = np.arange(goals)
+    fact = np.array([math.factorial(i) for i in k], dtype=float)
+    p = np.exp(-rates[:, None]) * rates[:, None] ** k / fact
+    p[:, -1] += np.maximum(1 - p.sum(axis=1), 0)
+    return p
+
+def poisson_grid(home_rate, away_rate, goals=11):
+    """
+    Scoreline probabilities of independent Poisson goals, last row / column absorb the tail
+    :return: array (goals, goals), [home goals, away goals]
+    """
+    ph, pa = poisson_pmf([home_rate, away_rate], goals)
+    return np.outer(ph, pa)
+
+class Exposure(object):
+    """
+    Profit / loss of pending subevents over every scoreline, kept per match
+    Constructor:
+    :param subevents: dict<subevent key, subevent dict>
+    :param goals: scorelines 0..goals-1 for both teams
+    """
+
+    def __init__(self, subevents, goals=11):
+        self.goals = goals
+        self._home, self._away = np.meshgrid(np.arange(goals), np.arange(goals), indexing='ij')
+        self._subs = {}
+        self._matches = {}
+        self._count = {}
+        self.rebuild(subevents)
+
+    def _pnl(self, subevents):
+        """
+        :return: array (len(subevents), goals, goals) of money back minus stakes
+        """
+        book = BetBook(subevents)
+        pay = book.payouts(self._home[None], self._away[None])
+        out = np.zeros((len(book), self.goals, self.goals))
+        np.add.at(out, book.owner, pay)
+        return out - book.stakes()[:, None, None]
+
+    def rebuild(self, subevents):
+        keys = subevents.keys()
+        pnl = self._pnl([subevents[k] for k in keys])
+        self._subs = {}
+        self._matches = {}
+        self._count = {}
+        for k, m in zip(keys, pnl):
+            self._add(k, subevents[k]['match_key'], m)
+
+    def _add(self, key, mkey, pnl):
+        if key in self._subs:
+            self._subs[key][1] += pnl
+        else:
+            self._subs[key] = [mkey, pnl.copy()]
+            self._count[mkey] = self._count.get(mkey, 0) + 1
+        if mkey in self._matches:
+            self._matches[mkey] += pnl
+        else:
+            self._matches[mkey] = pnl.copy()
+
+    def add_bet(self, key, sube, bet):
+        """
+        Account for one more bet on a subevent
+        :param key: subevent key
+        :param sube: subevent dict (odds and type are used)
+        :param bet: (stake, sub event)
+        """
+        self._add(key, sube['match_key'], self._pnl([dict(sube, bets=[bet])])[0])
+
+    def remove(self, key):
+        if key not in self._subs:
+            return
+        mkey, pnl = self._subs.pop(key)
+        self._matches[mkey] -= pnl
+        self._count[mkey] -= 1
+        if not self._count[mkey]:
+            del self._count[mkey]
+            del self._matches[mkey]
+
+    def matches(self):
+        """
+        :return: set of the match keys with pending bets
+        """
+        return set(self._matches)
+
+    def matrix(self, mkey):
+        """
+        :return: array (goals, goals) of profit / loss, [home goals, away goals]
+        """
+        return self._matches[mkey]
+
+    def worst(self, mkey):
+        """
+        :return: (lowest profit, (home, away) scoreline)
+        """
+        m = self._matches[mkey]
+        i = np.unravel_index(np.argmin(m), m.shape)
+        return float(m[i]), tuple([int(j) for j in i])
+
+    def best(self, mkey):
+        m = self._matches[mkey]
+        i = np.unravel_index(np.argmax(m), m.shape)
+        return float(m[i]), tuple([int(j) for j in i])
+
+    def expected(self, mkey, prob):
+        """
+        :param prob: array (goals, goals) of scoreline probabilities
+        :return: (expected profit, variance)
+        """
+        m = self._matches[mkey]
+        ev = float((m * prob).sum())
+        return ev, float((m ** 2 * prob).sum()) - ev ** 2
+
+    def total_worst(self):
+        return float(sum([m.min() for m in self._matches.values()]))
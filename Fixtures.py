@@ -0,0 +1,191 @@
+import json
+import time
+from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
+import requests
+from requests.adapters import HTTPAdapter
+from Journal import save_json
+
+def _fixture_id(f):
+    try:
+        href = f['_links']['self']['href']
+        return href[href.rfind('/')+1:]
+    except (KeyError, TypeError):
+        return '{}|{}|{}'.format(f.get('date'), f.get('homeTeamName'), f.get('awayTeamName'))
+
+class FixtureClient(object):
+    """
+    Fetch football-data fixtures concurrently over one keep-alive session
+    Constructor:
+    :param token: X-Auth-Token, None for anonymous access
+    :param chunk: max days of look-back per request, longer windows are split
+    :param workers: max concurrent requests (and pooled connections)
+    :param retries: retries on rate limit / connection errors
+    :param timeout: seconds per request
+    :param url: fixtures endpoint, default football-data v1
+    """
+    URL = 'http://api.football-data.org/v1/fixtures'
+    MAX_WAIT = 60
+
+    def __init__(self, token=None, chunk=14, workers=4, retries=3, timeout=10, url=None):
+        self.url = url or self.URL
+        self.chunk = max(chunk, 1)
+        self.workers = max(workers, 1)
+        self.retries = retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=self.workers))
+        self.session.headers.update({'X-Response-Control': 'minified'})
+        if token:
+            self.session.headers['X-Auth-Token'] = token
+
+    def _get(self, params):
+        """
+        One request with backoff
+        :param params: query parameters
+        :return: (list of fixtures, error message or None)
+        """
+        error = None
+        for attempt in range(self.retries + 1):
+            wait = 2 ** attempt
+            try:
+                resp = self.session.get(self.url, params=params, timeout=self.timeout)
+            except requests.RequestException, err:
+                error = str(err)
+            else:
+                if resp.status_code == 429:
+                    error = 'rate limited'
+                    try:
+                        wait = max(float(resp.headers.get('X-RequestCounter-Reset', wait)), 1)
+                    except ValueError:
+                        pass
+                else:
+                    try:
+                        body = resp.json()
+                    except ValueError:
+                        return [], 'bad response ({})'.format(resp.status_code)
+                    if 'fixtures' in body:
+                        return body['fixtures'], None
+                    return [], body.get('error', 'request fails ({})'.format(resp.status_code))
+            if attempt < self.retries:
+                time.sleep(min(wait, self.MAX_WAIT))
+        return [], error
+
+    def windows(self, days, today=None):
+        """
+        Query parameters covering the last `days` days
+        :param days: look-back days
+        :param today: utc date, default today
+        :return: list of params, one per chunk of at most self.chunk days
+        """
+        if days <= self.chunk:
+            return [{'timeFrame': 'p{}'.format(days)}]
+        today = today or datetime.utcnow().date()
+        return self.span(today - timedelta(days=days), today)
+
+    def span(self, start, end):
+        """
+        Query parameters covering the days from start to end, both included
+        :return: list of params, one per chunk of at most self.chunk days
+        """
+        params = []
+        while end >= start:
+            begin = max(end - timedelta(days=self.chunk - 1), start)
+            params.append({'timeFrameStart': begin.isoformat(), 'timeFrameEnd': end.isoformat()})
+            end = begin - timedelta(days=1)
+        return params
+
+    def fetch(self, days, ahead=1, spans=None):
+        """
+        Fixtures of the last `days` days and the next `ahead` days, requested in parallel
+        :param spans: list of (first day, last day) to request instead of the last `days` days
+        :return: (list of fixtures without duplicates, list of error messages)
+        """
+        if spans is None:
+            params = self.windows(days)
+        else:
+            params = [p for start, end in spans for p in self.span(start, end)]
+        params.append({'timeFrame': 'n{}'.format(ahead)})
+        pool = ThreadPool(min(self.workers, len(params)))
+        try:
+            replies = pool.map(self._get, params)
+        finally:
+            pool.close()
+        fixtures = {}
+        for fx, _ in replies:
+            for f in fx:
+                fixtures[_fixture_id(f)] = f
+        return fixtures.values(), [err for _, err in replies if err]
+
+class FixtureStore(object):
+    """
+    Finished fixtures kept on disk by fixture id, synced incrementally from a high-water mark
+    Constructor:
+    :param path: json file of the store
+    :param keep: days of fixtures kept before pruning
+    """
+    _DAY = '%Y-%m-%d'
+
+    def __init__(self, path='fixtures.json', keep=120):
+        self.path = path
+        self.keep = keep
+        try:
+            data = json.load(open(path, 'r'))
+        except:
+            data = {}
+        self.synced = data.get('synced')
+        self.covered = data.get('covered')
+        self.fixtures = data.get('fixtures', {})
+
+    def save(self):
+        save_json({'synced': self.synced, 'covered': self.covered, 'fixtures': self.fixtures}, self.path)
+
+    def gaps(self, days, today=None):
+        """
+        Days that still have to be downloaded to serve a look-back of `days`: before the covered mark and
+        from the last sync (included, its late matches may have finished since) to today
+        :return: list of (first day, last day)
+        """
+        today = today or datetime.utcnow().date()
+        start = today - timedelta(days=days)
+        if self.synced is None or self.covered is None:
+            return [(start, today)]
+        covered = datetime.strptime(self.covered, self._DAY).date()
+        synced = max(datetime.strptime(self.synced, self._DAY).date(), start)
+        rtn = []
+        if start < covered:
+            rtn.append((start, covered - timedelta(days=1)))
+        if synced <= today:
+            rtn.append((max(synced, covered, start), today))
+        return rtn
+
+    def sync(self, client, days):
+        """
+        Fetch the fixtures missing since the last sync
+        :param client: FixtureClient
+        :param days: look-back needed by the oldest pending match
+        :return: (number of fixtures downloaded, list of error messages)
+        """
+        today = datetime.utcnow().date()
+        fixtures, errors = client.fetch(days, spans=self.gaps(days, today))
+        for f in fixtures:
+            if f['status'].lower() == 'finished':
+                self.fixtures[_fixture_id(f)] = f
+        if not errors:
+            start = (today - timedelta(days=days)).strftime(self._DAY)
+            if self.covered is None or start < self.covered:
+                self.covered = start
+            self.synced = today.strftime(self._DAY)
+        oldest = (today - timedelta(days=self.keep)).strftime(self._DAY)
+        self.fixtures = {k: f for k, f in self.fixtures.items() if f['date'][:10] >= oldest}
+        self.covered = self.covered and max(self.covered, oldest)
+        self.save()
+        return len(fixtures), errors
+
+    def finished(self, since):
+        """
+        :param since: date, the earliest match day of interest
+        :return: stored finished fixtures played from `since` on
+        """
+        since = since.strftime(self._DAY)
+        return [f for f in self.fixtures.values() if f['date'][:10] >= since]
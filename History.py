@@ -0,0 +1,191 @@
+import json
+import mmap
+import os
+import struct
+from time import strftime
+
+class HistoryStore(object):
+    """
+    Bet history split in monthly segments of json lines, each with an offset index; entries are filed by the month
+    they are written in (never before their date nor the previous entry), so segments keep the order of writing
+    segment files - <root>/<YYYY-MM>.<part>.log, <root>/<YYYY-MM>.<part>.idx
+        the idx file holds (offset, journal seq) pairs of little endian unsigned 64 bit integers
+    Constructor:
+    :param root: directory of the store
+    :param max_bytes: size from which a month starts a new part
+    """
+    _PAIR = struct.Struct('<QQ')
+
+    def __init__(self, root='history', max_bytes=1 << 20):
+        self.root = root
+        self.max_bytes = max_bytes
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        self._segs = sorted([f[:-4] for f in os.listdir(root) if f.endswith('.idx')])
+        self._head = os.path.join(root, 'HEAD')
+        self._keys = os.path.join(root, 'keys')
+        self._open = {}
+        self.seq = 0
+        try:
+            seg, seq = open(self._head, 'r').read().split()
+            self._current = seg
+            self.seq = max(int(seq), self._last_seq(seg))
+        except:
+            self._current = None
+
+    def _path(self, seg, ext):
+        return os.path.join(self.root, '{}.{}'.format(seg, ext))
+
+    def count(self, seg):
+        try:
+            return os.path.getsize(self._path(seg, 'idx')) / self._PAIR.size
+        except OSError:
+            return 0
+
+    def __len__(self):
+        return sum([self.count(s) for s in self._segs])
+
+    def _pairs(self, seg, lo, hi):
+        """
+        :return: list of the (offset, seq) pairs of records lo..hi-1
+        """
+        size = self._PAIR.size
+        with open(self._path(seg, 'idx'), 'rb') as fin:
+            fin.seek(lo * size)
+            data = fin.read((hi - lo) * size)
+        return [self._PAIR.unpack_from(data, i) for i in range(0, len(data) - size + 1, size)]
+
+    def _last_seq(self, seg):
+        n = self.count(seg)
+        return n and self._pairs(seg, n - 1, n)[0][1] or 0
+
+    def _read(self, seg, lo, hi):
+        """
+        Records lo..hi-1 of a segment through a memory map
+        """
+        if hi <= lo:
+            return []
+        offsets = [o for o, _ in self._pairs(seg, lo, hi)]
+        with open(self._path(seg, 'log'), 'rb') as fin:
+            mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return [json.loads(mm[o:mm.find('\n', o)]) for o in offsets]
+            finally:
+                mm.close()
+
+    def _segment(self, month):
+        """
+        Segment taking new entries of a month, a new part when the last one is full
+        """
+        parts = [s for s in self._segs if s.startswith(month)]
+        if parts and os.path.getsize(self._path(parts[-1], 'log')) < self.max_bytes:
+            return parts[-1]
+        seg = '{}.{:03d}'.format(month, len(parts))
+        self._segs = sorted(self._segs + [seg])
+        return seg
+
+    def _handles(self, seg):
+        if seg not in self._open:
+            for h in self._open.values():
+                for f in h:
+                    f.close()
+            idx = self._path(seg, 'idx')
+            if os.path.exists(idx) and os.path.getsize(idx) % self._PAIR.size:
+                # drop a pair torn by a crash
+                with open(idx, 'r+b') as fout:
+                    fout.truncate(self.count(seg) * self._PAIR.size)
+            self._open = {seg: (open(self._path(seg, 'log'), 'ab'), open(self._path(seg, 'idx'), 'ab'),
+                                open(self._keys, 'ab'))}
+        return self._open[seg]
+
+    def append(self, entry, seq=0):
+        """
+        Add an entry to the segment of the current month
+        :param entry: bet log dict with a 'date' field ('%Y-%m-%d-%H:%M')
+        :param seq: journal sequence number of the entry
+        """
+        seg = self._segment(max(strftime('%Y-%m'), entry['date'][:7], (self._current or '')[:7]))
+        if seg != self._current:
+            with open(self._head, 'w') as fout:
+                fout.write('{} {}'.format(seg, self.seq))
+            self._current = seg
+        log, idx, keys = self._handles(seg)
+        log.seek(0, os.SEEK_END)
+        recno = self.count(seg)
+        offset = log.tell()
+        log.write(json.dumps(entry) + '\n')
+        log.flush()
+        idx.write(self._PAIR.pack(offset, seq))
+        idx.flush()
+        if entry.get('match_key'):
+            keys.write('{}\t{}\t{}\n'.format(entry['match_key'], seg, recno))
+            keys.flush()
+        self.seq = max(self.seq, seq)
+
+    def sync(self):
+        for h in self._open.values():
+            for f in h:
+                os.fsync(f.fileno())
+
+    def close(self):
+        self.sync()
+        for h in self._open.values():
+            for f in h:
+                f.close()
+        self._open = {}
+
+    def last(self, n):
+        """
+        :return: (number of entries before the returned ones, last n entries oldest first)
+        """
+        rtn = []
+        total = len(self)
+        for seg in reversed(self._segs):
+            if len(rtn) >= n:
+                break
+            cnt = self.count(seg)
+            rtn = self._read(seg, max(cnt - (n - len(rtn)), 0), cnt) + rtn
+        return total - len(rtn), rtn
+
+    def entry(self, n):
+        """
+        :return: the n-th entry (0 based) in the order of writing, or None
+        """
+        if n < 0:
+            return None
+        for seg in self._segs:
+            cnt = self.count(seg)
+            if n < cnt:
+                return self._read(seg, n, n + 1)[0]
+            n -= cnt
+        return None
+
+    def between(self, start, end):
+        """
+        Entries dated from start (inclusive) to end (exclusive), in '%Y-%m-%d...' string form, in the order of writing
+        """
+        # an entry is written in the month of its date or later
+        return [e for seg in self._segs if start[:7] <= seg[:7]
+                for e in self._read(seg, 0, self.count(seg)) if start <= e['date'] < end]
+
+    def of_match(self, key):
+        """
+        Entries settled for a match key
+        """
+        if not os.path.exists(self._keys) or not os.path.getsize(self._keys):
+            return []
+        rtn = []
+        needle = key + '\t'
+        with open(self._keys, 'rb') as fin:
+            mm = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                pos = mm.find(needle)
+                while pos >= 0:
+                    eol = mm.find('\n', pos)
+                    if not pos or mm[pos - 1] == '\n':
+                        _, seg, recno = mm[pos:eol].split('\t')
+                        rtn.extend(self._read(seg, int(recno), int(recno) + 1))
+                    pos = mm.find(needle, eol)
+            finally:
+                mm.close()
+        return rtn
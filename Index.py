@@ -0,0 +1,84 @@
+class Numbering(object):
+    """
+    1-based numbers of ordered keys, with the reverse map
+    Constructor:
+    :param keys: keys in display order
+    """
+
+    def __init__(self, keys=()):
+        self.reset(keys)
+
+    def reset(self, keys):
+        self._keys = list(keys)
+        self._nums = {k: i + 1 for i, k in enumerate(self._keys)}
+
+    def key(self, num):
+        """
+        :param num: number as int or string
+        :return: key shown with that number, None if there is none
+        """
+        try:
+            num = int(num)
+        except (TypeError, ValueError):
+            return None
+        if 1 <= num <= len(self._keys):
+            return self._keys[num - 1]
+        return None
+
+    def number(self, key):
+        return self._nums.get(key)
+
+    def __contains__(self, key):
+        return key in self._nums
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+class EventIndex(object):
+    """
+    Numbers of the leagues and of the events in each league as printLeagues / showEvents list them,
+    and where each event is; rebuilt only for the leagues whose events are added or removed
+    """
+
+    def __init__(self):
+        self.leagues = Numbering()
+        self._events = {}
+        self._where = {}
+
+    def rebuild(self, events, leagues=None):
+        """
+        :param events: dict<league, OrderedDict<event key, BetEvent>> in display order
+        :param leagues: leagues whose event list changed, None for all
+        """
+        if leagues is None:
+            leagues = set(events.keys()) | set(self._events.keys())
+        self.leagues.reset(sorted(events.keys()))
+        for league in leagues:
+            for k in self._events.pop(league, ()):
+                self._where.pop(k, None)
+            if league not in events:
+                continue
+            num = self._events[league] = Numbering(events[league].keys())
+            for i, k in enumerate(num):
+                self._where[k] = (league, i + 1)
+
+    def league(self, num):
+        return self.leagues.key(num)
+
+    def event(self, league, num):
+        """
+        :return: key of the event numbered num in a league, None if there is none
+        """
+        if league not in self._events:
+            return None
+        return self._events[league].key(num)
+
+    def locate(self, key):
+        """
+        :param key: BetEvent.key()
+        :return: (league, number), None for unknown events
+        """
+        return self._where.get(key)
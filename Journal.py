@@ -0,0 +1,121 @@
+import json
+import os
+from Stats import STATS
+
+def save_json(obj, path):
+    """
+    Write json atomically: a crash leaves either the old or the new file
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fout:
+        json.dump(obj, fout)
+        fout.flush()
+        os.fsync(fout.fileno())
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp, path)
+    if STATS.enabled:
+        STATS.observe('persist.bytes', os.path.getsize(path))
+
+class Journal(object):
+    """
+    Append-only journal of state changes, one json entry per line
+    Constructor:
+    :param path: journal file
+    :param batch: entries written between two fsyncs
+    :param compact: entries after which the owner should fold the journal into its snapshot
+    Attributes:
+        lazy - leave entries in the write buffer until sync, for batch runs
+    """
+
+    def __init__(self, path='rec.journal', batch=16, compact=500):
+        self.path = path
+        self.batch = batch
+        self.compact = compact
+        self.seq = 0
+        self.entries = 0
+        self._pending = 0
+        self._fout = None
+        self.lazy = False
+
+    def replay(self):
+        """
+        Read back the journal, a torn last line is dropped
+        :return: generator of entries in order
+        """
+        if not os.path.exists(self.path):
+            return
+        good = 0
+        with open(self.path, 'r') as fin:
+            for line in fin:
+                if not line.endswith('\n'):
+                    break
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                good += len(line)
+                self.seq = max(self.seq, entry['seq'])
+                self.entries += 1
+                yield entry
+        if good < os.path.getsize(self.path):
+            with open(self.path, 'r+') as fout:
+                fout.truncate(good)
+
+    def _open(self):
+        if self._fout is None:
+            self._fout = open(self.path, 'a')
+        return self._fout
+
+    def append(self, entry):
+        """
+        Stamp the entry with the next sequence number and write it
+        :param entry: dict, must be json serializable
+        :return: the entry
+        """
+        self.seq += 1
+        entry['seq'] = self.seq
+        fout = self._open()
+        line = json.dumps(entry) + '\n'
+        fout.write(line)
+        STATS.count('journal.bytes', len(line))
+        self.entries += 1
+        self._pending += 1
+        if self.lazy:
+            return entry
+        fout.flush()
+        if self._pending >= self.batch:
+            self.sync()
+        return entry
+
+    def flush(self):
+        """
+        Hand the buffered entries to the OS, without waiting for the disk
+        """
+        if self._fout is not None:
+            self._fout.flush()
+
+    def sync(self):
+        if self._fout is not None and self._pending:
+            self._fout.flush()
+            os.fsync(self._fout.fileno())
+        self._pending = 0
+
+    def due(self):
+        return self.entries >= self.compact
+
+    def truncate(self):
+        """
+        Drop every entry, to be called once they are all in the snapshot
+        """
+        self.sync()
+        if self._fout is not None:
+            self._fout.close()
+        self._fout = open(self.path, 'w')
+        self.entries = 0
+
+    def close(self):
+        self.sync()
+        if self._fout is not None:
+            self._fout.close()
+            self._fout = None
@@ -0,0 +1,62 @@
+import hashlib
+import re
+from datetime import datetime
+
+_DATE_FORMAT = '%Y-%m-%d-%H:%M'
+
+# event - kick off (12 digits) + digest of the team names; market - type letter + digest of event key and line
+EVENT_KEY = re.compile('^\d{12}[0-9a-f]{12}$')
+MARKET_KEY = re.compile('^[MST][0-9a-f]{15}$')
+
+def _digest(text, width):
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()[:width]
+
+def event_key(teams, when):
+    """
+    Stable key of an event, the same in every interpreter and run
+    :param teams: (home, visiting)
+    :param when: kick off, datetime or string in _DATE_FORMAT
+    :return: interned str of 24 characters
+    """
+    if not isinstance(when, datetime):
+        when = datetime.strptime(when, _DATE_FORMAT)
+    return intern(when.strftime('%Y%m%d%H%M') + _digest(u'\t'.join([unicode(t) for t in teams]), 12))
+
+def market_key(ekey, bkey):
+    """
+    :param ekey: event_key of the event
+    :param bkey: odds signature of the market, see AbstractBetType.bkey
+    :return: interned str of 16 characters
+    """
+    return intern(bkey[0] + _digest(ekey + bkey, 15))
+
+def legacy(key):
+    """
+    :return: whether key was made by the hash() based scheme of older versions
+    """
+    return not (EVENT_KEY.match(key) or MARKET_KEY.match(key))
+
+def migrate(record, market):
+    """
+    Rename the legacy keys of rec.bin in place
+    :param record: rec.bin dict
+    :param market: callable(subevent dict, new event key) -> new market key
+    :return: dict<old key, new key> of the renamed matches and subevents
+    """
+    renamed = {}
+    for k, m in record['match'].items():
+        if legacy(k):
+            renamed[k] = event_key(m['teams'], m['match_time'])
+    for k, s in record['subevent'].items():
+        if legacy(k) or legacy(s['match_key']):
+            mkey = renamed.get(s['match_key'], s['match_key'])
+            renamed[k] = market(s, mkey)
+    for k, new in renamed.items():
+        if k in record['match']:
+            record['match'][new] = record['match'].pop(k)
+        elif k in record['subevent']:
+            sube = record['subevent'][new] = record['subevent'].pop(k)
+            sube['match_key'] = renamed.get(sube['match_key'], sube['match_key'])
+    return renamed
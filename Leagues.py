@@ -0,0 +1,101 @@
+import hashlib
+import json
+import re
+from Journal import save_json
+
+class LeagueFilter(object):
+    """
+    Followed leagues: name prefixes (pref) kept in a trie and regular expressions (repat) matched from the start,
+    combined in one alternation; each decision is memoized and persisted until the watchlist changes
+    Constructor:
+    :param pref: list of league name prefixes
+    :param repat: list of regular expressions
+    :param path: json file of the memoized decisions, None to keep them in memory only
+    """
+
+    def __init__(self, pref, repat, path=None):
+        self.pref = list(pref)
+        self.repat = list(repat)
+        self.path = path
+        self._compile()
+        self._decisions = {}
+        self._dirty = False
+        if path is not None:
+            try:
+                data = json.load(open(path, 'r'))
+            except:
+                data = {}
+            if data.get('signature') == self._signature:
+                self._decisions = data.get('decisions', {})
+
+    def _compile(self):
+        trie = {}
+        for p in self.pref:
+            node = trie
+            for ch in p:
+                node = node.setdefault(ch, {})
+            node[None] = True
+        regex = len(self.repat) and re.compile('|'.join(['(?:{})'.format(r) for r in self.repat])) or None
+        self._signature = hashlib.sha1(json.dumps([sorted(self.pref), sorted(self.repat)])).hexdigest()
+        self._trie, self._regex = trie, regex
+
+    def _prefixed(self, league):
+        node = self._trie
+        if None in node:
+            return True
+        for ch in league:
+            node = node.get(ch)
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+    def keep(self, league):
+        """
+        :return: whether the league is followed
+        """
+        try:
+            return self._decisions[league]
+        except KeyError:
+            pass
+        rtn = self._decisions[league] = self._prefixed(league) or bool(self._regex and self._regex.match(league))
+        self._dirty = True
+        return rtn
+
+    def add(self, pattern, regex=False):
+        """
+        :return: False if the pattern was followed already
+        """
+        target = self.pref
+        if regex:
+            target = self.repat
+        if pattern in target:
+            return False
+        if regex:
+            re.compile(pattern)
+        target.append(pattern)
+        self._changed()
+        return True
+
+    def remove(self, pattern):
+        """
+        Stop following a prefix or a regular expression
+        :return: False if the pattern is not followed
+        """
+        for target in [self.pref, self.repat]:
+            if pattern in target:
+                target.remove(pattern)
+                self._changed()
+                return True
+        return False
+
+    def _changed(self):
+        self._compile()
+        self._decisions = {}
+        self._dirty = True
+
+    def save(self):
+        if self.path is not None and self._dirty:
+            save_json({'signature': self._signature, 'decisions': self._decisions}, self.path)
+            self._dirty = False
@@ -0,0 +1,177 @@
+import math
+import re
+from collections import Counter, defaultdict
+from datetime import datetime
+import numpy as np
+from Stats import STATS
+
+_VECTORS = {}
+
+def _skeleton(name):
+    name = re.sub('\(.+?\)|(cf)|(fc)|[^a-z]', '', name.lower())
+    return re.sub('a|e|i|o|u', '', name)
+
+def team_vector(name):
+    """
+    Unit vector of consonant uni/bi-grams of a team name, cached per name
+    :param name: team name
+    :return: dict<gram, weight>
+    """
+    try:
+        return _VECTORS[name]
+    except KeyError:
+        pass
+    sk = _skeleton(name)
+    grams = Counter(sk)
+    grams.update([sk[i:i+2] for i in range(len(sk) - 1)])
+    s = math.sqrt(sum([c ** 2 for c in grams.values()])) or 1.0
+    vec = _VECTORS[name] = {g: c / s for g, c in grams.items()}
+    return vec
+
+class TeamIndex(object):
+    """
+    Sparse n-gram matrix of a list of team names, stored as parallel arrays of its non-zero cells
+    Constructor:
+    :param names: list<str>, position is the document id
+    """
+
+    def __init__(self, names):
+        self._vocab = {}
+        docs, grams, weights = [], [], []
+        for doc, name in enumerate(names):
+            for g, w in team_vector(name).items():
+                docs.append(doc)
+                grams.append(self._vocab.setdefault(g, len(self._vocab)))
+                weights.append(w)
+        self.size = len(names)
+        self._docs = np.array(docs, dtype=np.intp)
+        self._grams = np.array(grams, dtype=np.intp)
+        self._weights = np.array(weights, dtype=float)
+
+    def scores(self, name):
+        """
+        Cosine similarity of name against every indexed name, the matrix times the query vector
+        :return: array (size,) of scores
+        """
+        query = np.zeros(len(self._vocab))
+        for g, w in team_vector(name).items():
+            if g in self._vocab:
+                query[self._vocab[g]] = w
+        return np.bincount(self._docs, weights=self._weights * query[self._grams], minlength=self.size)
+
+class AliasIndex(object):
+    """
+    Learned team aliases, persisted inside knowledge of log.json
+    Constructor:
+    :param knowledge: dict<football-data team id, (football-data name, our name)>
+    """
+
+    def __init__(self, knowledge):
+        self.knowledge = knowledge
+        self._ours = defaultdict(set)
+        for tid, v in knowledge.items():
+            if isinstance(v, (list, tuple)) and len(v) == 2:
+                self._ours[v[1]].add(tid)
+
+    def learn(self, tid, theirs, ours):
+        old = self.knowledge.get(tid)
+        if isinstance(old, (list, tuple)) and len(old) == 2:
+            self._ours[old[1]].discard(tid)
+        self.knowledge[tid] = (theirs, ours)
+        self._ours[ours].add(tid)
+
+    def ids(self, ours):
+        return self._ours.get(ours, set())
+
+    def __contains__(self, tid):
+        return tid in self.knowledge
+
+    def ours(self, tid):
+        return self.knowledge[tid][1]
+
+def _team_id(fixture, side):
+    href = fixture['_links'][side]['href']
+    return href[href.rfind('/')+1:]
+
+def by_kickoff(fixtures, times=None):
+    """
+    Group football-data fixtures by kick off, with the team ids FixtureMatcher needs
+    :param fixtures: list<fixture>
+    :param times: set of kick off datetimes to keep, all if None
+    :return: dict<kick off datetime, list<fixture>>, fixtures are copies carrying homeid/awayid
+    """
+    rtn = {}
+    for f in fixtures:
+        mtime = datetime.strptime(f['date'], '%Y-%m-%dT%H:%M:%SZ')
+        if times is not None and mtime not in times:
+            continue
+        f = dict(f, homeid=_team_id(f, 'homeTeam'), awayid=_team_id(f, 'awayTeam'))
+        rtn.setdefault(mtime, []).append(f)
+    return rtn
+
+class FixtureMatcher(object):
+    """
+    Match pending matches with finished fixtures kicked off at the same time
+    Constructor:
+    :param fixtures: dict<kick off datetime, list<fixture>>, fixtures carry homeid/awayid
+    :param aliases: AliasIndex
+    :param accept: similarity from which a candidate is taken without asking
+    :param topk: max candidates returned
+    """
+
+    def __init__(self, fixtures, aliases, accept=0.85, topk=5):
+        self.aliases = aliases
+        self.accept = accept
+        self.topk = topk
+        self._fixtures = fixtures
+        self._index = {}
+
+    def _slot(self, mtime):
+        if mtime not in self._index:
+            fx = self._fixtures.get(mtime, [])
+            self._index[mtime] = (TeamIndex([f['homeTeamName'] for f in fx]),
+                                  TeamIndex([f['awayTeamName'] for f in fx]),
+                                  {(f['homeid'], f['awayid']): f for f in fx})
+        return self._index[mtime]
+
+    def known(self, mtime, teams):
+        """
+        :return: the fixture whose both teams are known aliases of ours, or None
+        """
+        if mtime not in self._fixtures:
+            return None
+        byid = self._slot(mtime)[2]
+        for h in self.aliases.ids(teams[0]):
+            for a in self.aliases.ids(teams[1]):
+                if (h, a) in byid:
+                    return byid[(h, a)]
+        return None
+
+    def candidates(self, mtime, teams):
+        """
+        Best fixtures for a match, highest similarity first
+        :param mtime: kick off time
+        :param teams: (home, away) names of ours
+        :return: list<(score, fixture)>, at most topk
+        """
+        if mtime not in self._fixtures:
+            return []
+        home, away = self._slot(mtime)[:2]
+        both = home.scores(teams[0]) * away.scores(teams[1])
+        fx = self._fixtures[mtime]
+        STATS.count('matching.scored', len(both))
+        if not len(both):
+            return []
+        top = np.argpartition(-both, min(self.topk, len(both)) - 1)[:self.topk]
+        top = top[np.argsort(-both[top], kind='mergesort')]
+        return [(float(both[d]), fx[d]) for d in top if both[d] > 0]
+
+    def auto(self, candidates):
+        """
+        :return: the candidate fixture to accept without asking, or None
+        """
+        if not candidates or candidates[0][0] < self.accept:
+            return None
+        if len(candidates) > 1 and candidates[1][0] >= self.accept:
+            return None
+        return candidates[0][1]
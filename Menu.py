@@ -1,6 +1,7 @@
 import json
 import re
 import readline
+from bisect import bisect_left
 import rlcompleter
 import math
 
@@ -88,6 +89,77 @@ class OptionCompleter(object):
             response = None
         return response
 
+class CompletionIndex(object):
+    """
+    Case-insensitive completion over sorted words with bisect, nested per word
+    Constructor:
+    :param options: list of words, or dict<word, sub options>
+        sub options are a list, a dict, a single word, None or a callable returning one of them;
+        callables are called once, the first time their level is completed
+    """
+
+    def __init__(self, options=None):
+        if isinstance(options, dict):
+            self._children = dict(options)
+        elif isinstance(options, (list, tuple, set)):
+            self._children = dict.fromkeys(options)
+        else:
+            self._children = dict.fromkeys(options is not None and [options] or [])
+        pairs = sorted([(w.lower(), w) for w in self._children])
+        self._keys = [k for k, _ in pairs]
+        self._words = [w for _, w in pairs]
+        self.current_candidates = []
+
+    def child(self, word):
+        """
+        :return: CompletionIndex of the words following word, None if there is none
+        """
+        if word not in self._children:
+            return None
+        sub = self._children[word]
+        if not isinstance(sub, CompletionIndex):
+            if callable(sub):
+                sub = sub()
+            sub = self._children[word] = CompletionIndex(sub)
+        return sub
+
+    def prefixed(self, text):
+        """
+        :return: words starting with text, sorted
+        """
+        if not text:
+            return self._words[:]
+        text = text.lower()
+        rtn = []
+        for i in xrange(bisect_left(self._keys, text), len(self._keys)):
+            if not self._keys[i].startswith(text):
+                break
+            rtn.append(self._words[i])
+        return rtn
+
+    def candidates(self, words, text):
+        """
+        :param words: complete words before the one being completed
+        :param text: beginning of the word being completed
+        """
+        node = self
+        for w in words:
+            node = node.child(w)
+            if node is None:
+                return []
+        return node.prefixed(text)
+
+    def complete(self, text, state):
+        if state == 0:
+            orgline = readline.get_line_buffer()
+            begin = readline.get_begidx()
+            end = readline.get_endidx()
+            self.current_candidates = self.candidates(orgline[:begin].split(), orgline[begin:end])
+        try:
+            return self.current_candidates[state]
+        except IndexError:
+            return None
+
 def get_help_text(toPrint, delim='\t', fstr=None, show_index=True):
     if not fstr:
         length = min([len(t) for t in toPrint])
@@ -167,25 +239,59 @@ class AbstractMenu(object):
                 order = 'q'
             print ''
             order = order.split()
-            try:
-                o = order[0]
-            except:
+            if not len(order):
                 continue
             self._main_before_run()
-            if o == 'help':
-                self.help(*order[1:])
-                continue
-            if o not in self.firstArgs:
-                print 'Error: "%s" is not a valid option!' % o
-                continue
-            if not self.firstArgs[o].valid(len(order) - 1):
-                print self.firstArgs[o].invalid_msg(len(order) - 1)
-                continue
-            func = self.run(self.firstArgs[o], *order[1:])
+            func = self.dispatch(order)
             self._main_after_run()
         self._main_after()
         print func
 
+    def batch_loop(self, lines, flush_every=0):
+        """
+        Run commands without prompt nor prelude, persisting in groups
+        :param lines: iterable of command lines, '#' starts a comment
+        :param flush_every: persist every flush_every commands, 0 - only at the end
+        """
+        self.firstArgs = {s: i for i in self.arguments for s in [i.name()] + i.shortcuts()}
+        func = None
+        count = 0
+        self._main_before()
+        self._batch_before()
+        for line in lines:
+            order = line.split('#')[0].split()
+            if not len(order):
+                continue
+            func = self.dispatch(order)
+            count += 1
+            if flush_every and not count % flush_every:
+                self._batch_after_run()
+                self._main_after_run()
+            if func:
+                break
+        self._batch_after()
+        self._main_after()
+        if func:
+            print func
+
+    def dispatch(self, order):
+        """
+        Run one command
+        :param order: list of words, command first
+        :return: what the command returns, non-empty to end the loop
+        """
+        o = order[0]
+        if o == 'help':
+            self.help(*order[1:])
+            return None
+        if o not in self.firstArgs:
+            print 'Error: "%s" is not a valid option!' % o
+            return None
+        if not self.firstArgs[o].valid(len(order) - 1):
+            print self.firstArgs[o].invalid_msg(len(order) - 1)
+            return None
+        return self.run(self.firstArgs[o], *order[1:])
+
     def _main_before(self):
         pass
 
@@ -195,6 +301,15 @@ class AbstractMenu(object):
     def _main_before_run(self):
         pass
 
+    def _batch_before(self):
+        pass
+
+    def _batch_after_run(self):
+        pass
+
+    def _batch_after(self):
+        pass
+
     def _main_after_run(self):
         pass
 
@@ -243,12 +358,24 @@ class PromptTestItem(PromptItem):
 class AbstractCompleteMenu(AbstractMenu):
     def __init__(self):
         super(AbstractCompleteMenu, self).__init__()
+        self._completer = None
+        self._completer_gen = None
+        self.completion_gen = 0
 
     def _genCompleter(self):
         raise NotImplementedError()
 
+    def invalidate_completer(self):
+        """
+        Have the completer built again before next prompt, safe to call from any thread
+        """
+        self.completion_gen += 1
+
     def prelude(self):
-        readline.set_completer(self._genCompleter().complete)
+        if self._completer is None or self._completer_gen != self.completion_gen:
+            self._completer_gen = self.completion_gen
+            self._completer = self._genCompleter()
+            readline.set_completer(self._completer.complete)
         self._prelude_1()
 
     def _prelude_1(self):
@@ -0,0 +1,113 @@
+import httplib
+import json
+import os
+import shutil
+import socket
+import threading
+import time
+import urllib2
+from Stats import STATS
+
+class OddsCache(object):
+    """
+    Keep a local snapshot of the odds feed and only download it when it changes
+    Constructor:
+    :param url: odds feed url
+    :param path: snapshot file, the response headers are kept in path + '.meta'
+    :param ttl: seconds during which the snapshot is trusted without asking the server
+    :param timeout: seconds to wait on the server before falling back to the snapshot
+    """
+
+    def __init__(self, url, path='odds.xml', ttl=300, timeout=30):
+        self.url = url
+        self.path = path
+        self.ttl = ttl
+        self.timeout = timeout
+        self._metapath = path + '.meta'
+        try:
+            self.meta = json.load(open(self._metapath, 'r'))
+        except:
+            self.meta = {}
+        self.status = None
+        self._lock = threading.Lock()
+
+    def has_snapshot(self):
+        return os.path.exists(self.path) and 'time' in self.meta
+
+    def age(self):
+        if not self.has_snapshot():
+            return None
+        return time.time() - self.meta['time']
+
+    def fresh(self):
+        age = self.age()
+        return age is not None and 0 <= age < self.ttl
+
+    def _save_meta(self):
+        json.dump(self.meta, open(self._metapath, 'w'))
+
+    def fetch(self, force=False):
+        with self._lock:
+            with STATS.timer('odds.fetch'):
+                fin = self._fetch(force)
+            STATS.count('odds.' + self.status)
+            return fin
+
+    def _fetch(self, force=False):
+        """
+        Get the odds feed, from the snapshot when possible
+        :param force: ignore the freshness window and ask the server anyway
+        :return: file object on the local snapshot; self.status tells where it came from
+            cached - within freshness window, no network
+            not-modified - server answered 304
+            downloaded - a new snapshot was written
+            stale - server unreachable or failing, old snapshot served
+        """
+        if not force and self.fresh():
+            self.status = 'cached'
+            return open(self.path, 'rb')
+        req = urllib2.Request(self.url)
+        if self.has_snapshot():
+            if self.meta.get('etag'):
+                req.add_header('If-None-Match', self.meta['etag'])
+            if self.meta.get('last_modified'):
+                req.add_header('If-Modified-Since', self.meta['last_modified'])
+        try:
+            resp = urllib2.urlopen(req, timeout=self.timeout)
+        except urllib2.HTTPError, err:
+            if not self.has_snapshot():
+                raise
+            if err.code != 304:
+                return self._stale()
+            self.meta['time'] = time.time()
+            self._save_meta()
+            self.status = 'not-modified'
+            return open(self.path, 'rb')
+        except (urllib2.URLError, httplib.HTTPException, socket.error):
+            if not self.has_snapshot():
+                raise
+            return self._stale()
+
+        tmp = self.path + '.tmp'
+        try:
+            with open(tmp, 'wb') as fout:
+                shutil.copyfileobj(resp, fout)
+        except (httplib.HTTPException, socket.error):
+            os.remove(tmp)
+            if not self.has_snapshot():
+                raise
+            return self._stale()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        os.rename(tmp, self.path)
+        STATS.observe('odds.bytes', os.path.getsize(self.path))
+        self.meta = {'time': time.time(),
+                     'etag': resp.info().getheader('ETag'),
+                     'last_modified': resp.info().getheader('Last-Modified')}
+        self._save_meta()
+        self.status = 'downloaded'
+        return open(self.path, 'rb')
+
+    def _stale(self):
+        self.status = 'stale'
+        return open(self.path, 'rb')
@@ -0,0 +1,208 @@
+import json
+import os
+import threading
+from time import time
+import numpy as np
+from Journal import save_json
+from Keys import event_key, legacy
+from Settlement import MONEYLINE, SPREAD, TOTAL
+
+MARKETS = [('moneyline', MONEYLINE), ('spread', SPREAD), ('total', TOTAL)]
+
+# column name -> (dtype, values per row)
+_COLUMNS = [('time', np.int64, 1), ('event', np.int32, 1), ('market', np.int8, 1),
+            ('line', np.float32, 1), ('odds', np.float32, 3)]
+
+def market_row(kind, market):
+    """
+    :return: (line, (odd1, odd2, odd3)) of a market object
+    """
+    if kind == MONEYLINE:
+        return 0.0, tuple(market.odds)
+    if kind == SPREAD:
+        return market.odds[0][0], (market.odds[0][1], market.odds[1][1], np.nan)
+    return market.goalnum, (market._odds[0], market._odds[1], np.nan)
+
+class OddsHistory(object):
+    """
+    Odds snapshots stored column by column in flat binary files, a row is written only when a market moves
+    files - <root>/<column>.bin for time, event, market, line and odds (3 per row), <root>/events.jsonl,
+        <root>/HEAD - rows and events.jsonl bytes of the last complete record(), written last; anything past it
+        is a torn write and cut off on open
+    market - 0 moneyline (home, draw, away), 1 spread (home line; home, away), 2 total (goals; over, under)
+    Constructor:
+    :param root: directory of the store
+    """
+
+    def __init__(self, root='odds_history'):
+        self.root = root
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        self._evpath = os.path.join(root, 'events.jsonl')
+        self._head = os.path.join(root, 'HEAD')
+        self.events = []
+        self._ids = {}
+        self._rows, self._evbytes = self._repair()
+        if os.path.exists(self._evpath):
+            with open(self._evpath, 'r') as fin:
+                for line in fin:
+                    if line.endswith('\n'):
+                        info = json.loads(line)
+                        if legacy(info['key']):
+                            info['key'] = event_key(info['teams'], info['time'])
+                        self._add_event(info)
+        self._last = None
+        self._lock = threading.Lock()
+
+    def _path(self, col):
+        return os.path.join(self.root, col + '.bin')
+
+    def _repair(self):
+        """
+        Cut every file back to the last complete record(), a crash can leave columns of different lengths
+        :return: (rows, events.jsonl bytes)
+        """
+        sizes = [os.path.exists(self._path(c)) and os.path.getsize(self._path(c)) / (np.dtype(t).itemsize * n) or 0
+                 for c, t, n in _COLUMNS]
+        try:
+            head = json.load(open(self._head, 'r'))
+            rows, evbytes = head['rows'], head['events']
+        except:
+            # store of an older version, keep the complete rows and event lines
+            rows, evbytes = min(sizes), 0
+            if os.path.exists(self._evpath):
+                with open(self._evpath, 'rb') as fin:
+                    evbytes = fin.read().rfind('\n') + 1
+        rows = min([rows] + sizes)
+        for c, t, n in _COLUMNS:
+            width = np.dtype(t).itemsize * n
+            if os.path.exists(self._path(c)) and os.path.getsize(self._path(c)) > rows * width:
+                with open(self._path(c), 'r+b') as fout:
+                    fout.truncate(rows * width)
+        if os.path.exists(self._evpath) and os.path.getsize(self._evpath) > evbytes:
+            with open(self._evpath, 'r+b') as fout:
+                fout.truncate(evbytes)
+        return rows, evbytes
+
+    def _add_event(self, info):
+        self._ids[info['key']] = len(self.events)
+        self.events.append(info)
+
+    def __len__(self):
+        return self._rows
+
+    def event_ids(self, keys):
+        """
+        :return: array of the event ids of keys, -1 for events never recorded
+        """
+        return np.array([self._ids.get(k, -1) for k in keys], dtype=np.int64)
+
+    def columns(self):
+        """
+        Memory map every column
+        :return: dict<column name, array>, odds has shape (rows, 3)
+        """
+        rows = len(self)
+        cols = {}
+        for c, t, n in _COLUMNS:
+            if not rows:
+                cols[c] = np.zeros((0, n) if n > 1 else 0, dtype=t)
+                continue
+            cols[c] = np.memmap(self._path(c), dtype=t, mode='r', shape=(rows, n) if n > 1 else (rows,))
+        return cols
+
+    def _last_rows(self):
+        """
+        Last stored (line, odds) per (event, market), read once from the columns
+        """
+        if self._last is None:
+            cols = self.columns()
+            self._last = {}
+            if len(cols['time']):
+                ident = cols['event'].astype(np.int64) * 4 + cols['market']
+                _, first = np.unique(ident[::-1], return_index=True)
+                for i in len(ident) - 1 - first:
+                    self._last[(int(cols['event'][i]), int(cols['market'][i]))] = \
+                        (float(cols['line'][i]), tuple([float(o) for o in cols['odds'][i]]))
+        return self._last
+
+    def record(self, events, when=None):
+        """
+        Append the markets that moved since they were last recorded
+        :param events: dict<league, dict<event key, BetEvent>>
+        :param when: epoch seconds of the snapshot, default now
+        :return: number of rows written
+        """
+        with self._lock:
+            return self._record(events, int(when or time()))
+
+    def _record(self, events, when):
+        last = self._last_rows()
+        rows = []
+        fresh = []
+        for league, evs in events.items():
+            for key, evt in evs.items():
+                if key not in self._ids:
+                    info = {'key': key, 'league': league, 'teams': list(evt.teams),
+                            'time': evt.deadline.strftime('%Y-%m-%d-%H:%M')}
+                    self._add_event(info)
+                    fresh.append(info)
+                eid = self._ids[key]
+                for attr, kind in MARKETS:
+                    market = getattr(evt, attr, None)
+                    if market is None:
+                        continue
+                    line, odds = market_row(kind, market)
+                    val = (float(np.float32(line)), tuple([float(np.float32(o)) for o in odds]))
+                    old = last.get((eid, kind))
+                    if old is not None and repr(old) == repr(val):
+                        continue
+                    last[(eid, kind)] = val
+                    rows.append((eid, kind, line, odds))
+        if fresh:
+            with open(self._evpath, 'ab') as fout:
+                fout.seek(0, os.SEEK_END)
+                for info in fresh:
+                    fout.write(json.dumps(info) + '\n')
+                self._evbytes = fout.tell()
+        if rows:
+            eid, kind, line, odds = zip(*rows)
+            data = {'time': np.full(len(rows), when, dtype=np.int64),
+                    'event': np.array(eid, dtype=np.int32),
+                    'market': np.array(kind, dtype=np.int8),
+                    'line': np.array(line, dtype=np.float32),
+                    'odds': np.array(odds, dtype=np.float32)}
+            for c, t, n in _COLUMNS:
+                with open(self._path(c), 'ab') as fout:
+                    data[c].tofile(fout)
+            self._rows += len(rows)
+        if fresh or rows:
+            save_json({'rows': self._rows, 'events': self._evbytes}, self._head)
+        return len(rows)
+
+    def _select(self, mask):
+        cols = self.columns()
+        rtn = {}
+        for attr, kind in MARKETS:
+            sel = np.nonzero(mask & (cols['market'] == kind))[0]
+            if len(sel):
+                rtn[attr] = {'time': cols['time'][sel], 'line': cols['line'][sel], 'odds': cols['odds'][sel],
+                             'event': cols['event'][sel]}
+        return rtn
+
+    def series(self, key):
+        """
+        Line movement of one match
+        :param key: BetEvent.key()
+        :return: dict<market name, dict<'time' / 'line' / 'odds' / 'event', array>>
+        """
+        if key not in self._ids:
+            return {}
+        return self._select(self.columns()['event'] == self._ids[key])
+
+    def league(self, league):
+        """
+        Line movement of every match of a league, rows of all matches together ('event' tells them apart)
+        """
+        ids = [i for i, info in enumerate(self.events) if info['league'] == league]
+        return self._select(np.in1d(self.columns()['event'], ids))
@@ -0,0 +1,92 @@
+from multiprocessing import Pool, cpu_count
+import numpy as np
+from Exposure import poisson_grid, poisson_pmf
+
+_COARSE = np.arange(0.05, 4.01, 0.05)
+
+def _total_mask(line, goals):
+    """
+    :return: array (goals, goals) - share of an over bet won on each scoreline, a push counts half
+    """
+    tot = np.add.outer(np.arange(goals), np.arange(goals))
+    parts = int(line * 4) & 1 and [line - 0.25, line + 0.25] or [line]
+    return sum([(tot > p) + 0.5 * (tot == p) for p in parts]) / float(len(parts))
+
+def _search(home, away, moneyline, total, prior, goals):
+    """
+    :return: (home rate, away rate) of the grid home x away closest to the fair probabilities
+    """
+    ph, pa = poisson_pmf(home, goals), poisson_pmf(away, goals)
+    err = 1e-3 * ((home[:, None] - prior[0]) ** 2 + (away[None, :] - prior[1]) ** 2)
+    if moneyline is not None:
+        inv = 1.0 / np.asarray(moneyline, dtype=float)
+        fair = inv / inv.sum()
+        hw = ph.dot(np.tril(np.ones((goals, goals)), -1)).dot(pa.T)
+        dr = ph.dot(pa.T)
+        err += (hw - fair[0]) ** 2 + (dr - fair[1]) ** 2 + (1 - hw - dr - fair[2]) ** 2
+    if total is not None:
+        inv = 1.0 / np.asarray(total[1:3], dtype=float)
+        err += (ph.dot(_total_mask(total[0], goals)).dot(pa.T) - inv[0] / inv.sum()) ** 2
+    i, j = np.unravel_index(np.argmin(err), err.shape)
+    return home[i], away[j]
+
+def fit_rates(moneyline=None, total=None, prior=(1.4, 1.1), goals=11):
+    """
+    Goal rates whose Poisson scorelines reproduce the fair probabilities of the odds best
+    :param moneyline: decimal odds (home, draw, away), or None
+    :param total: (goal line, over odds, under odds), or None
+    :param prior: rates used without odds, lightly pulled towards with odds
+    :return: (home rate, away rate)
+    """
+    if moneyline is None and total is None:
+        return tuple([float(r) for r in prior])
+    h, a = _search(_COARSE, _COARSE, moneyline, total, prior, goals)
+    fine = np.arange(-0.05, 0.0501, 0.005)
+    h, a = _search(np.maximum(h + fine, 0.01), np.maximum(a + fine, 0.01), moneyline, total, prior, goals)
+    return float(h), float(a)
+
+def _fit(job):
+    key, moneyline, total, prior, goals = job
+    return key, fit_rates(moneyline, total, prior, goals)
+
+def fit_many(jobs, processes=None, min_jobs=200):
+    """
+    Fit the goal rates of many matches, on a process pool when there are enough of them
+    :param jobs: list of (match key, moneyline, total, prior, goals), see fit_rates
+    :param min_jobs: below this many matches the pool costs more than it saves
+    :return: dict<match key, (home rate, away rate)>
+    """
+    processes = processes or cpu_count()
+    if processes < 2 or len(jobs) < min_jobs:
+        return dict(map(_fit, jobs))
+    pool = Pool(processes)
+    try:
+        return dict(pool.map(_fit, jobs, chunksize=max(1, len(jobs) / (processes * 4))))
+    finally:
+        pool.close()
+        pool.join()
+
+def price(exposure, rates, sims=0, seed=None):
+    """
+    Expected profit / loss of the pending bets under independent Poisson goals
+    :param exposure: Exposure of the pending subevents
+    :param rates: dict<match key, (home rate, away rate)>
+    :param sims: number of simulated rounds over all matches, 0 for the exact sums only
+    :return: dict - matches (dict<match key, (expected, variance)>), ev, var of the portfolio,
+        samples (array (sims,) of portfolio profit / loss) when simulated
+    """
+    keys = [k for k in exposure.matches() if k in rates]
+    matches = {k: exposure.expected(k, poisson_grid(rates[k][0], rates[k][1], goals=exposure.goals)) for k in keys}
+    rtn = {'matches': matches,
+           'ev': sum([ev for ev, _ in matches.values()]),
+           'var': sum([var for _, var in matches.values()])}
+    if sims:
+        rng = np.random.RandomState(seed)
+        last = exposure.goals - 1
+        samples = np.zeros(sims)
+        for k in keys:
+            home = np.minimum(rng.poisson(rates[k][0], sims), last)
+            away = np.minimum(rng.poisson(rates[k][1], sims), last)
+            samples += exposure.matrix(k)[home, away]
+        rtn['samples'] = samples
+    return rtn
@@ -0,0 +1,89 @@
+import numpy as np
+from OddsHistory import MARKETS, market_row
+from Settlement import TYPES
+
+def market_arrays(events):
+    """
+    Every market of the feed as columns
+    :param events: dict<league, dict<event key, BetEvent>>
+    :return: dict<column, array> - league (index in leagues), leagues, key, name, kind, line,
+        odds (n, 3) with nan for the missing third outcome of spread and total
+    """
+    leagues = sorted(events.keys())
+    league, key, name, kind, line, odds = [], [], [], [], [], []
+    for i, lg in enumerate(leagues):
+        for k, evt in events[lg].items():
+            for attr, kd in MARKETS:
+                market = getattr(evt, attr, None)
+                if market is None:
+                    continue
+                ln, od = market_row(kd, market)
+                league.append(i)
+                key.append(k)
+                name.append(evt.name())
+                kind.append(kd)
+                line.append(ln)
+                odds.append(od)
+    return {'league': np.array(league, dtype=np.int64), 'leagues': leagues, 'key': key, 'name': name,
+            'kind': np.array(kind, dtype=np.int64), 'line': np.array(line, dtype=float),
+            'odds': np.array(odds, dtype=float).reshape(-1, 3)}
+
+def implied(odds):
+    """
+    :param odds: array (n, 3) of decimal odds, nan for missing outcomes
+    :return: (probabilities without the margin (n, 3), overround (n,))
+    """
+    inv = 1.0 / odds
+    book = np.nansum(inv, axis=1)
+    return inv / book[:, None], book - 1
+
+def robust_z(values, groups):
+    """
+    Distance of each value from the median of its group, in scaled median absolute deviations
+    """
+    z = np.zeros(len(values))
+    if not len(values):
+        return z
+    order = np.argsort(groups, kind='mergesort')
+    for idx in np.split(order, np.flatnonzero(np.diff(groups[order])) + 1):
+        v = values[idx]
+        med = np.median(v)
+        mad = np.median(np.abs(v - med)) * 1.4826
+        if mad > 0:
+            z[idx] = (v - med) / mad
+    return z
+
+def scan(events, history=None, k=10, by='margin'):
+    """
+    Margin and implied probabilities of every market, with the outliers against the consensus
+    margin - overround compared with the markets of the same type in the league (robust z score)
+    move - first outcome probability against its average over the odds history
+    :param events: dict<league, dict<event key, BetEvent>>
+    :param history: OddsHistory, needed for the move
+    :param k: number of outliers
+    :param by: 'margin' or 'move'
+    :return: dict of market_arrays plus prob, margin, z, move (nan without history) and top (indexes of the outliers)
+    """
+    cols = market_arrays(events)
+    prob, margin = implied(cols['odds'])
+    z = robust_z(margin, cols['league'] * 4 + cols['kind'])
+    move = np.full(len(margin), np.nan)
+    if history is not None and len(history) and len(margin):
+        hist = history.columns()
+        ident = np.asarray(hist['event'], dtype=np.int64) * 4 + hist['market']
+        hprob = implied(np.asarray(hist['odds'], dtype=float))[0][:, 0]
+        ids = history.event_ids(cols['key'])
+        size = max(int(ident.max()), int(ids.max()) * 4 + 3) + 1
+        total = np.bincount(ident, weights=hprob, minlength=size)
+        count = np.bincount(ident, minlength=size)
+        mine = ids * 4 + cols['kind']
+        ok = (ids >= 0) & (count[np.maximum(mine, 0)] > 0)
+        move[ok] = prob[ok, 0] - total[mine[ok]] / count[mine[ok]]
+    score = np.abs(z)
+    if by == 'move':
+        score = np.abs(np.nan_to_num(move))
+    cols.update(prob=prob, margin=margin, z=z, move=move, top=np.argsort(-score, kind='mergesort')[:k])
+    return cols
+
+def market_name(kind):
+    return TYPES[kind]
@@ -0,0 +1,202 @@
+import BaseHTTPServer
+import SocketServer
+import json
+import os
+import re
+import sys
+import threading
+import traceback
+import urllib2
+from StringIO import StringIO
+
+_USER = re.compile('^[A-Za-z0-9_-]+$')
+
+class _Output(object):
+    """
+    sys.stdout replacement sending the prints of a thread to its own buffer while it is captured
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    def capture(self):
+        self._local.buf = StringIO()
+
+    def release(self):
+        buf, self._local.buf = self._local.buf, None
+        return buf.getvalue()
+
+    def write(self, text):
+        (getattr(self._local, 'buf', None) or self._stream).write(text)
+
+    def flush(self):
+        if getattr(self._local, 'buf', None) is None:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+class Accounts(object):
+    """
+    Per-user menus of the service, sharing the odds of one board menu
+    Constructor:
+    :param root: directory of the service, users live in <root>/<user> as with betfun.sh
+    :param factory: callable(root, odds_from) -> MainMenu
+    """
+
+    def __init__(self, root, factory):
+        self.root = root
+        self.factory = factory
+        self.board = factory(root, None)
+        self.board.interactive = False
+        self._menus = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def account(self, user):
+        """
+        :return: (menu, lock) of a user, the menu is created on first use
+        """
+        with self._lock:
+            if user not in self._locks:
+                self._locks[user] = threading.RLock()
+            lock = self._locks[user]
+        with lock:
+            if user not in self._menus:
+                home = os.path.join(self.root, user)
+                if not os.path.isdir(home):
+                    os.makedirs(home)
+                menu = self.factory(home, self.board)
+                menu.interactive = False
+                menu.firstArgs = {s: i for i in menu.arguments for s in [i.name()] + i.shortcuts()}
+                with self._lock:
+                    self._menus[user] = menu
+        return self._menus[user], lock
+
+    def call(self, user, order):
+        """
+        Run a command for a user, the prints of the command are returned as output
+        :param order: list of words, command first
+        :return: (http status, reply dict), 500 with the error when the command raised
+        """
+        if not _USER.match(user):
+            return 400, {'error': 'invalid user name "%s"' % user}
+        if not len(order):
+            return 400, {'error': 'no command'}
+        menu, lock = self.account(user)
+        error = None
+        with lock:
+            sys.stdout.capture()
+            try:
+                menu._settle_pending()
+                result = menu.dispatch(order)
+                if result:
+                    # quit - persist and forget the account, it is loaded again on next call
+                    menu._main_after()
+                    with self._lock:
+                        del self._menus[user]
+                else:
+                    menu._main_after_run()
+            except Exception, err:
+                traceback.print_exc()
+                error = '"{}" failed ({}: {})'.format(order[0], err.__class__.__name__, err)
+            finally:
+                output = sys.stdout.release()
+        if error is not None:
+            return 500, {'error': error, 'output': output}
+        return 200, {'output': output, 'balance': menu.record['balance'], 'result': result}
+
+    def close(self):
+        with self._lock:
+            menus = self._menus.items()
+        for user, menu in menus:
+            with self._locks[user]:
+                menu._main_after()
+        self.board._main_after()
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    POST /<user>/<command> with {"args": [...]} runs a menu command
+    GET /<user> returns the balance, pending bets and matches
+    """
+
+    def _reply(self, code, data):
+        body = json.dumps(data)
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 2:
+            return self._reply(404, {'error': 'use POST /<user>/<command>'})
+        try:
+            length = int(self.headers.getheader('Content-Length') or 0)
+            args = json.loads(self.rfile.read(length) or '{}').get('args', [])
+        except ValueError:
+            return self._reply(400, {'error': 'body is not json'})
+        self._reply(*self.server.accounts.call(parts[0], [parts[1]] + [unicode(a) for a in args]))
+
+    def do_GET(self):
+        user = self.path.strip('/')
+        if not _USER.match(user):
+            return self._reply(404, {'error': 'use GET /<user>'})
+        menu, lock = self.server.accounts.account(user)
+        with lock:
+            self._reply(200, {'balance': menu.record['balance'], 'match': menu.matches, 'subevent': menu.subevents})
+
+    def log_message(self, fmt, *args):
+        pass
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def serve(port, factory, root='.', host='127.0.0.1'):
+    """
+    Serve the accounts under root until interrupted
+    :param factory: callable(root, odds_from) -> MainMenu
+    """
+    sys.stdout = _Output(sys.stdout)
+    server = _Server((host, port), _Handler)
+    server.accounts = Accounts(root, factory)
+    print 'Serving betfun on {}:{}'.format(host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.accounts.close()
+
+def client(address, user):
+    """
+    Thin client: read commands at the prompt and run them on the service
+    :param address: host:port of the service
+    """
+    url = 'http://{}/{}/'.format(address, user)
+    while True:
+        try:
+            order = raw_input('Betfun@{}> '.format(user)).split()
+        except (EOFError, KeyboardInterrupt):
+            order = ['quit']
+        if not len(order):
+            continue
+        req = urllib2.Request(url + order[0], json.dumps({'args': order[1:]}), {'Content-Type': 'application/json'})
+        try:
+            reply = json.load(urllib2.urlopen(req))
+        except urllib2.HTTPError, err:
+            reply = json.load(err)
+        except urllib2.URLError, err:
+            print 'ERROR: cannot reach {} ({})'.format(address, err.reason)
+            return
+        if 'error' in reply:
+            print 'ERROR:', reply['error']
+            continue
+        print reply['output'].rstrip('\n')
+        print 'Balance: {}'.format(reply['balance'])
+        if order[0] in ['q', ':q', 'exit', 'quit']:
+            return
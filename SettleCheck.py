@@ -0,0 +1,86 @@
+import argparse
+import random
+import sys
+from Events import Moneyline, Spread, TotalGoals
+from Exposure import Exposure
+from Settlement import settle
+
+_TYPES = {c.name: c for c in [Moneyline, Spread, TotalGoals]}
+
+def _odd(rng):
+    return round(rng.uniform(1.2, 6.0), 3)
+
+def random_subevent(rng, mkey, kind):
+    """
+    A pending subevent as stored in rec.bin, lines on every quarter so quarter lines and pushes come up
+    :param kind: 'Moneyline', 'Spread' or 'TotalGoals'
+    """
+    if kind == 'Moneyline':
+        odds, subs = [_odd(rng) for _ in range(3)], [1, 0, -1]
+    elif kind == 'Spread':
+        adj = rng.randint(-10, 10) / 4.0
+        odds, subs = [[adj, _odd(rng)], [-adj, _odd(rng)]], [1, -1]
+    else:
+        odds, subs = [rng.randint(2, 18) / 4.0, [_odd(rng), _odd(rng)]], [1, -1]
+    return {'match_key': mkey, 'match_time': '2026-01-01-12:00', 'period': 'Match', 'type': kind, 'odds': odds,
+            'bets': [[float(rng.randint(1, 100)), rng.choice(subs)] for _ in range(rng.randint(1, 3))]}
+
+def _line(sube):
+    if sube['type'] == 'Spread':
+        return sube['odds'][0][0]
+    return sube['type'] == 'TotalGoals' and sube['odds'][0] or None
+
+def _pushed(sube, home, away):
+    """
+    :return: whether a bet of the subevent gets some stake back on the scoreline
+    """
+    line = _line(sube)
+    if line is None:
+        return False
+    lines = int(line * 4) & 1 and [line - 0.25, line + 0.25] or [line]
+    if sube['type'] == 'Spread':
+        return any([home + l == away for l in lines])
+    return any([home + away == l for l in lines])
+
+def check(n=3000, seed=0, goals=7):
+    """
+    Settle random subevents with execute() of the Events classes, settle() and the Exposure matrices
+    :return: (list of mismatch descriptions, dict of what was covered)
+    """
+    rng = random.Random(seed)
+    subevents, results = {}, {}
+    for i in range(n):
+        mkey = 'm%d' % (i / 3)
+        subevents['s%d' % i] = random_subevent(rng, mkey, rng.choice(sorted(_TYPES)))
+        results.setdefault(mkey, (rng.randint(0, goals - 1), rng.randint(0, goals - 1)))
+    got = settle(subevents, results)
+    grid = Exposure({}, goals=goals)
+    bad = []
+    covered = {'subevents': n, 'quarter lines': 0, 'pushes': 0}
+    for k, sube in sorted(subevents.items()):
+        market = _TYPES[sube['type']](**sube)
+        want = market.execute(results[sube['match_key']])
+        if abs(got[k] - want) > 1e-9:
+            bad.append('settle {} {}: {} != execute {}'.format(k, results[sube['match_key']], got[k], want))
+        line = _line(sube)
+        covered['quarter lines'] += line is not None and int(line * 4) & 1
+        pnl = grid._pnl([sube])[0]
+        for h in range(goals):
+            for a in range(goals):
+                want = market.execute((h, a)) - market.total_bet
+                covered['pushes'] += _pushed(sube, h, a)
+                if abs(pnl[h, a] - want) > 1e-9:
+                    bad.append('exposure {} {}-{}: {} != execute {}'.format(k, h, a, pnl[h, a], want))
+    return bad, covered
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the NumPy settlement against execute() of the market classes')
+    parser.add_argument('-n', type=int, default=3000, help='random subevents')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    bad, covered = check(args.n, args.seed)
+    for line in bad[:20]:
+        print line
+    print '{} mismatches over {subevents} subevents ({quarter lines} quarter lines, {pushes} pushed scorelines)'.format(
+        len(bad), **covered)
+    sys.exit(bad and 1 or 0)
@@ -0,0 +1,103 @@
+import numpy as np
+
+# market codes shared by the settlement, the odds history, the scan and the backtest
+MONEYLINE, SPREAD, TOTAL = 0, 1, 2
+KINDS = {'Moneyline': MONEYLINE, 'Spread': SPREAD, 'TotalGoals': TOTAL}
+TYPES = {v: k for k, v in KINDS.items()}
+
+class BetBook(object):
+    """
+    Bets of many subevents laid out as parallel arrays, one row per (quarter split) bet
+    Constructor:
+    :param subevents: list<subevent dict> as stored in rec.bin
+    Attributes:
+        stake, line, side, odd, kind - per row, line is the spread adjust or the total goal number
+        owner - index of the subevent of the row
+        bounds - rows of subevent i are bounds[i]:bounds[i+1]
+    """
+
+    def __init__(self, subevents):
+        rows = []
+        bounds = [0]
+        for i, sube in enumerate(subevents):
+            kind = KINDS[sube['type']]
+            odds = sube['odds']
+            for bet, sub in sube['bets']:
+                if kind == MONEYLINE:
+                    rows.append((bet, 0.0, sub, odds[1-sub], kind, i))
+                    continue
+                if kind == SPREAD:
+                    line, odd = odds[int(0.5-sub)][0] * sub, odds[int(0.5-sub)][1]
+                else:
+                    line, odd = odds[0], odds[1][int(0.5-sub)]
+                if int(line*4) & 1:
+                    rows.append((bet/2.0, line+0.25, sub, odd, kind, i))
+                    rows.append((bet/2.0, line-0.25, sub, odd, kind, i))
+                else:
+                    rows.append((bet, line, sub, odd, kind, i))
+            bounds.append(len(rows))
+        cols = zip(*rows) or [()] * 6
+        self.stake = np.array(cols[0], dtype=float)
+        self.line = np.array(cols[1], dtype=float)
+        self.side = np.array(cols[2], dtype=float)
+        self.odd = np.array(cols[3], dtype=float)
+        self.kind = np.array(cols[4], dtype=np.int8)
+        self.owner = np.array(cols[5], dtype=np.intp)
+        self.bounds = bounds
+
+    def __len__(self):
+        return len(self.bounds) - 1
+
+    def _expand(self, *extra):
+        """
+        Per-row columns shaped to broadcast against `extra` trailing dimensions
+        """
+        shape = (-1,) + (1,) * len(extra)
+        return [c.reshape(shape) for c in (self.stake, self.line, self.side, self.odd, self.kind)]
+
+    def payouts(self, home, away):
+        """
+        Money back of every row, settlement rules of Moneyline / Spread / TotalGoals
+        :param home: home goals, shape (rows,) or broadcastable against rows on the first axis
+        :param away: away goals, same shape as home
+        :return: array of payouts with the broadcast shape
+        """
+        home = np.asarray(home, dtype=float)
+        away = np.asarray(away, dtype=float)
+        stake, line, side, odd, kind = self._expand(*home.shape[1:])
+        won = stake * odd
+        zero = np.zeros(np.broadcast(stake, home).shape)
+        # Moneyline - sign of the goal difference against the side
+        ml = np.where(np.sign(home - away) == side, won, zero)
+        # Spread - adjusted difference, push gives the stake back
+        cat = np.sign((home + line) - away)
+        sp = np.where(cat == side, won, zero) + np.where(cat == 0, stake, zero)
+        # Total - goals over / under the line, push gives the stake back
+        diff = (home + away) - line
+        tg = np.where(diff * side > 0, won, zero) + np.where(diff == 0, stake, zero)
+        return np.where(kind == MONEYLINE, ml, np.where(kind == SPREAD, sp, tg))
+
+    def totals(self, pay):
+        """
+        Sum row payouts per subevent in row order, as execute() does
+        """
+        rows = pay.tolist()
+        return [sum(rows[self.bounds[i]:self.bounds[i+1]]) for i in range(len(self))]
+
+    def stakes(self):
+        return np.bincount(self.owner, weights=self.stake, minlength=len(self))
+
+def settle(subevents, results):
+    """
+    Settle many subevents in one pass
+    :param subevents: dict<subevent key, subevent dict>
+    :param results: dict<match key, (home goals, away goals)>
+    :return: dict<subevent key, money back>, equal to execute() of each subevent
+    """
+    keys = [k for k, s in subevents.items() if s['match_key'] in results]
+    if not keys:
+        return {}
+    book = BetBook([subevents[k] for k in keys])
+    res = np.array([results[subevents[k]['match_key']] for k in keys], dtype=float).reshape(-1, 2)
+    pay = book.payouts(res[book.owner, 0], res[book.owner, 1])
+    return dict(zip(keys, book.totals(pay)))
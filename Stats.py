@@ -0,0 +1,157 @@
+import json
+import math
+import threading
+import time
+from functools import wraps
+
+class Histogram(object):
+    """
+    Count, sum, extremes and power-of-two buckets of the observed values
+    """
+    __slots__ = ('count', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = {}
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        b = value > 0 and int(math.floor(math.log(value, 2))) or None
+        self.buckets[b] = self.buckets.get(b, 0) + 1
+
+    def mean(self):
+        return self.count and self.total / self.count or 0.0
+
+    def quantile(self, q):
+        """
+        :return: upper bound of the bucket holding the q quantile
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for b in sorted(self.buckets.keys(), key=lambda b: b is None and float('-inf') or b):
+            seen += self.buckets[b]
+            if seen >= rank:
+                return b is None and 0.0 or min(2.0 ** (b + 1), self.max)
+        return self.max
+
+    def toDict(self):
+        return {'count': self.count, 'total': self.total, 'min': self.min, 'max': self.max,
+                'mean': self.mean(), 'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99)}
+
+class _Timer(object):
+    __slots__ = ('registry', 'name', 'tick')
+
+    def __init__(self, registry, name):
+        self.registry = registry
+        self.name = name
+
+    def __enter__(self):
+        self.tick = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.registry.observe(self.name, time.time() - self.tick)
+        return False
+
+class _NoTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NO_TIMER = _NoTimer()
+
+class Registry(object):
+    """
+    Named counters and histograms of one process; every call returns at once while disabled
+    Constructor:
+    :param enabled: record from the start
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value):
+        """
+        Add a value to the histogram of name, timers are histograms of seconds
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].add(value)
+
+    def timer(self, name):
+        """
+        Context manager timing its block into the histogram of name
+        """
+        return self.enabled and _Timer(self, name) or _NO_TIMER
+
+    def timed(self, name):
+        """
+        Decorator timing every call into the histogram of name
+        """
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Timer(self, name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters = {}
+            self.histograms = {}
+
+    def snapshot(self):
+        """
+        :return: (dict<name, count>, dict<name, histogram dict>)
+        """
+        with self._lock:
+            return dict(self.counters), {k: h.toDict() for k, h in self.histograms.items()}
+
+    def export(self, path):
+        """
+        Append every metric to path as a json line
+        :return: number of lines written
+        """
+        counters, histograms = self.snapshot()
+        now = time.time()
+        lines = [json.dumps({'time': now, 'since': self.started, 'name': k, 'type': 'counter', 'value': v})
+                 for k, v in sorted(counters.items())]
+        lines.extend([json.dumps(dict(h, time=now, since=self.started, name=k, type='histogram'))
+                      for k, h in sorted(histograms.items())])
+        with open(path, 'a') as fout:
+            fout.write(''.join([l + '\n' for l in lines]))
+        return len(lines)
+
+# registry of the process, switched on by the "stats" conf key or the --stats flags
+STATS = Registry()
@@ -1,23 +1,56 @@
-from Menu import AbstractCompleteMenu, SimpleCompleter, OptionCompleter, PromptTestItem, baseline_init
+from Menu import AbstractCompleteMenu, CompletionIndex, PromptTestItem, baseline_init
 from Events import *
+from Odds import OddsCache
+from Fixtures import FixtureClient, FixtureStore
+from Matching import AliasIndex, FixtureMatcher, by_kickoff
+from Journal import Journal, save_json
+from History import HistoryStore
+from Settlement import settle
+from Exposure import Exposure, poisson_grid
+from OddsHistory import OddsHistory
+from Index import Numbering, EventIndex
+from Keys import event_key, legacy, migrate
+from Stats import STATS
+from Leagues import LeagueFilter
+import Service
+import Scan
+import Pricing
+import Backtest
 import readline
+import argparse
+import sys
 import json
-from datetime import datetime
-from time import gmtime, localtime, strftime
-import urllib2
-import unirest
-import xml.etree.ElementTree as ET
+import os
+from datetime import datetime, timedelta
+from time import gmtime, localtime, strftime, time
+import xml.etree.cElementTree as ET
 import re
-from collections import OrderedDict, Counter
+import threading
+import numpy as np
+from collections import Counter, OrderedDict
 import pytz
 
 _DATE_FORMAT = '%Y-%m-%d-%H:%M'
 _HourDiff = datetime.strptime(strftime(_DATE_FORMAT, gmtime()), _DATE_FORMAT) - datetime.strptime(strftime(_DATE_FORMAT, localtime()), _DATE_FORMAT)
+# option codes offered by the completer for each market, see MainMenu._parse_option
+_OPTION_CODES = [('moneyline', ['m:w', 'm:d', 'm:l']), ('spread', ['s:w', 's:l']), ('total', ['t:o', 't:u'])]
+_EVENTS_HEADER = '    '.join(['{:^{l}}'.format(t, l=l) for t,l in zip(['Moneyline','Spread','Total'], [19,26,22])])
 _sdict = {c.__name__: c for c in [Moneyline, Spread, TotalGoals]}
 
 def _gmtNow():
     return datetime.strptime(strftime(_DATE_FORMAT, gmtime()), _DATE_FORMAT)
 
+def _insort(od, key, value):
+    """
+    Insert into an OrderedDict kept sorted by value, only the items after it are moved
+    """
+    tail = [(k, v) for k, v in od.items() if v > value]
+    for k, _ in tail:
+        del od[k]
+    od[key] = value
+    for k, v in tail:
+        od[k] = v
+
 def _pdtime(td):
     m = td.seconds / 60
     if not m:
@@ -26,15 +59,6 @@ def _pdtime(td):
     return ' '.join(['{1:>2} {2:>2}{0}'.format((t[0] > 1) and 's' or ' ',*t)
                      for t in zip([td.days, h, m%60], ['day', 'hour', 'min']) if t[0]])
 
-def _toUniCounter(name):
-    name = re.sub('\(.+?\)|(cf)|(fc)|[^a-z]', '', name.lower())
-    keys, counts = zip(*Counter(re.sub('a|e|i|o|u', '', str(name))).items())
-    s = math.sqrt(sum([i**2 for i in counts]))
-    return Counter(dict(zip(keys, [c/s for c in counts])))
-
-def _cosine(c1, c2):
-    return sum([c1[k] * c2[k] for k in c1 if k in c2])
-
 class TickTock(object):
 
     def __init__(self):
@@ -43,62 +67,185 @@ class TickTock(object):
     def tock(self):
         return datetime.now() - self.tick
 
+    def fmt(self, fstr='{:.2f} s', gen=lambda td: tuple([td.total_seconds()])):
+        return fstr.format(*gen(self.tock()))
+
     def ptime(self, fstr='{:.2f} s', gen=lambda td: tuple([td.total_seconds()])):
-        print fstr.format(*gen(self.tock()))
+        print self.fmt(fstr, gen)
 
 
 class MainMenu(AbstractCompleteMenu):
 
-    def __init__(self):
+    def __init__(self, root='.', odds_from=None):
+        """
+        :param root: directory of the user files
+        :param odds_from: MainMenu whose odds are shared instead of loading our own
+        """
         super(MainMenu, self).__init__()
+        self.root = root
+        self.interactive = True
         self.prompt = 'Betfun> '
         self.arguments = [
             PromptTestItem('acquireExtra', 'Money', num_valid=1, htext='Add new money to balance', shortcuts=[]),
             PromptTestItem('printLeagues', '', htext='Print current available leagues', shortcuts=['p', 'ls', 'list']),
             PromptTestItem('printMatches', '', htext='Print current available matches', shortcuts=['m', 'lm', 'match']),
-            PromptTestItem('printBetHistory', '', htext='Print history', shortcuts=[':h', ':hist', 'history']),
+            PromptTestItem('printBetHistory', '[last_n | from_date [to_date] | -m entry_num]',
+                           htext='Print history, -m for every entry of the match of an entry',
+                           shortcuts=[':h', ':hist', 'history']),
             PromptTestItem('printPendingBets', '', htext='Print pending bets', shortcuts=['lb']),
             PromptTestItem('chooseLeague', 'league_name [print_flag]', num_valid=1, htext='Choose the league to work on',
-                           shortcuts=['cd', 'cl'], listf=lambda x: ['_'.join(k.split()) for k in x._events.keys()]),
+                           shortcuts=['cd', 'cl'], listf=lambda x: x._league_words()),
             PromptTestItem('showEvents', '[league_name]', htext='List current betable event in a league',
-                           shortcuts=['show', 'll'], listf=lambda x: ['_'.join(k.split()) for k in x._events.keys()]),
+                           shortcuts=['show', 'll'], listf=lambda x: x._league_words()),
             PromptTestItem('betOn', 'league_name match_num selection bets', num_valid=3, htext='Bet on specific match',
-                           shortcuts=['bet', ':b'], listf=lambda x:['_'.join(k.split()) for k in x._events.keys()]),
+                           shortcuts=['bet', ':b'], listf=lambda x: x._bet_words()),
             PromptTestItem('applyResult', 'match_num home-visiting', num_valid=2, htext='Apply result on specific match',
-                           shortcuts=['apply'], listf=lambda x:[]),
+                           shortcuts=['apply'], listf=lambda x: x._match_words()),
+            PromptTestItem('exposure', '[match_num]', htext='Show profit / loss of pending bets over scorelines',
+                           shortcuts=['ex'], listf=lambda x: x._match_words()),
+            PromptTestItem('refresh', '', htext='Refresh the odds now', shortcuts=['r']),
+            PromptTestItem('price', '[simulations]', htext='Expected profit of pending bets from goal rates fitted on the odds',
+                           shortcuts=[]),
+            PromptTestItem('scan', '[top_k] [margin | move]', htext='Markets of all leagues farthest from the consensus',
+                           shortcuts=[], listf=lambda x: ['margin', 'move']),
+            PromptTestItem('watch', '[-r] [league_prefix | regex]', htext='Follow more leagues, list the watchlist without argument',
+                           shortcuts=[]),
+            PromptTestItem('unwatch', 'league_prefix | regex', num_valid=1, htext='Stop following leagues',
+                           shortcuts=[], listf=lambda x: x._leagues.pref + x._leagues.repat),
+            PromptTestItem('stats', '[reset | export file]', htext='Show timers and counters of this session',
+                           shortcuts=[], listf=lambda x: ['reset', 'export']),
             PromptTestItem('quit', '', htext='Exit bet fun', shortcuts=['q', ':q', 'exit'])
         ]
         ###
         # None Menu-critical
         ###
         try:
-            self.record = json.load(open('rec.bin', 'r'))
+            self.record = json.load(open(self._file('rec.bin'), 'r'))
         except:
             self.record = {'balance': 10000, 'match': {}, 'subevent': {}}
+        # keys of older versions came from hash(), they are recomputed from teams, kick off and odds
+        renamed = migrate(self.record, self._market_key)
         self.matches = self.record['match']
         self.subevents = self.record['subevent']
+        # pending subevents per match, a match is dropped with its last one
+        self._sub_count = Counter([s['match_key'] for s in self.subevents.values()])
         try:
-            self.logs = json.load(open('log.json', 'r'))
+            self.logs = json.load(open(self._file('log.json'), 'r'))
         except:
-            self.logs = {'bet_logs': [], 'knowledge': {'unmatch':[]}}
+            self.logs = {'knowledge': {'unmatch':[]}}
         self.knowledge = self.logs['knowledge']
-        try:
-            self.conf = json.load(open('conf.json','r'))
-        except:
-            self.conf = {"pref": ["FIFA", "Segunda", "Eng. F", "Eng. P", "USA"], "repat": ["UEFA C[A-Za-z]+$", "Serie A$", "La Liga$", "Bundesliga$"]}
-        self.repat = [re.compile(r) for r in self.conf['repat']]
-        self._events = {}
-        self._pull_bets()
-        self._pull_results()
+        self._aliases = AliasIndex(self.knowledge)
+        self.history = HistoryStore(self._file('history'))
+        if 'bet_logs' in self.logs:
+            # move the bet logs of older versions into the history store
+            for entry in self.logs.pop('bet_logs'):
+                self.history.append(entry)
+            self.history.sync()
+            save_json(self.logs, self._file('log.json'))
+        self._exposure = None
+        self._match_ids = None
+        self.journal = Journal(self._file('rec.journal'))
+        self.journal.seq = max(self.record.get('seq', 0), self.logs.get('seq', 0), self.history.seq)
+        for entry in self.journal.replay():
+            self._rekey(entry, renamed)
+            self._apply(entry, record=entry['seq'] > self.record.get('seq', 0),
+                        logs=entry['seq'] > self.logs.get('seq', 0), history=entry['seq'] > self.history.seq)
+        if renamed:
+            self._snapshot()
+        self._exposure = Exposure(self.subevents)
+        if odds_from is not None:
+            # accounts of a server run with the conf, leagues and fixture client of the board
+            self.conf = odds_from.conf
+            self._leagues = odds_from._leagues
+            self._fixture_client = odds_from._fixture_client
+        else:
+            try:
+                self.conf = json.load(open(self._file('conf.json'), 'r'))
+            except:
+                self.conf = {"pref": ["FIFA", "Segunda", "Eng. F", "Eng. P", "USA"], "repat": ["UEFA C[A-Za-z]+$", "Serie A$", "La Liga$", "Bundesliga$"],
+                             "odds_ttl": 300}
+            self._leagues = LeagueFilter(self.conf['pref'], self.conf['repat'], self._file('leagues.json'))
+            self._fixture_client = FixtureClient(token=self.conf.get('fd_token'), chunk=self.conf.get('fd_chunk', 14),
+                                                url=self.conf.get('fd_url'))
+        if self.conf.get('stats'):
+            STATS.enabled = True
+        self._fixture_store = FixtureStore(self._file('fixtures.json'))
+        self._fixtures = None
+        self._stages = OrderedDict([('Odds', 'loading...'), ('Results', 'loading...')])
+        self._stop = threading.Event()
+        self._results_ready = threading.Event()
+        self._odds_from = odds_from
+        if odds_from is None:
+            self._odds = OddsCache(self.conf.get('odds_url', 'http://xml.pinnaclesports.com/'),
+                                   path=self._file(self.conf.get('odds_cache', 'odds.xml')), ttl=self.conf.get('odds_ttl', 300),
+                                   timeout=self.conf.get('odds_timeout', 30))
+            self._odds_history = OddsHistory(self._file('odds_history'))
+            self._events = {}
+            self._evindex = EventIndex()
+            self._bets_ready = threading.Event()
+            self._evlock = threading.RLock()
+            self._refresh_lock = threading.Lock()
+            self._background(self._pull_bets, self._bets_ready, 'Odds')
+            self._refresh_worker = self._background(self._refresher, threading.Event(), 'Refresh')
+        else:
+            # the events dict is updated in place from now on, so it can be shared once loaded
+            odds_from._bets_ready.wait()
+            self._odds = odds_from._odds
+            self._odds_history = odds_from._odds_history
+            self._events = odds_from._events
+            self._evindex = odds_from._evindex
+            self._bets_ready = odds_from._bets_ready
+            self._evlock = odds_from._evlock
+            self._stages['Odds'] = 'shared'
+            self._refresh_worker = None
+        matches = {k: dict(m) for k, m in self.matches.items() if 'unmatch' not in m}
+        self._background(self._pull_results, self._results_ready, 'Results', matches)
         self._currlg = None
         self._doprint = False
         # self.results = {}
 
-    def _prelude_1(self):
+    def _file(self, name):
+        return os.path.join(self.root, name)
+
+    def _background(self, func, ready, stage, *args):
+        """
+        Run a loading stage in a daemon thread, flagging ready when it ends whatever happens
+        """
+        def work():
+            try:
+                func(*args)
+            except Exception, err:
+                self._stages[stage] = 'failed ({})'.format(err)
+            finally:
+                ready.set()
+        worker = threading.Thread(target=work, name=stage)
+        worker.daemon = True
+        worker.start()
+        return worker
+
+    def _wait_bets(self):
+        if not self._bets_ready.is_set():
+            print 'Odds are still loading...'
+            while not self._bets_ready.is_set():
+                self._bets_ready.wait(0.5)
+
+    def _settle_pending(self):
+        """
+        Match the fixtures downloaded in background, if any, then settle the finished matches
+        """
+        if self._results_ready.is_set() and self._fixtures is not None:
+            fixtures, self._fixtures = self._fixtures, None
+            self._match_results(fixtures)
         self._execute_results()
+
+    def _prelude_1(self):
+        self._settle_pending()
         print
         print '='*30
         print 'Current Balance: ', self.record['balance']
+        print ' | '.join(['{}: {}'.format(*s) for s in self._stages.items()])
+        if self._bets_ready.is_set() and self._odds.age() is not None:
+            print 'Odds updated {} ago'.format(_pdtime(timedelta(seconds=self._odds.age())).strip())
         print '='*30
         if self._currlg is not None:
             print 'Current Focus League selection:', self._currlg
@@ -108,141 +255,372 @@ class MainMenu(AbstractCompleteMenu):
             print '='*30
 
     def _genCompleter(self):
-        return OptionCompleter({i.name(): i._listf(self) for i in self.arguments})
+        """
+        Command level only, the levels below are built when first completed
+        """
+        return CompletionIndex({s: (lambda i=i: i._listf(self)) for i in self.arguments for s in [i.name()] + i.shortcuts()})
+
+    def _league_words(self):
+        with self._evlock:
+            return ['_'.join(k.split()) for k in self._events.keys()]
+
+    def _bet_words(self):
+        """
+        :return: league names followed by their match numbers, or match numbers of the focus league
+        """
+        with self._evlock:
+            words = {'_'.join(k.split()): (lambda k=k: self._event_words(k)) for k in self._events.keys()}
+        if self._currlg is not None:
+            words.update(self._event_words(self._currlg))
+        return words
+
+    def _event_words(self, league):
+        """
+        :return: dict<match number, option codes of the markets offered>
+        """
+        with self._evlock:
+            return {str(i + 1): [c for attr, codes in _OPTION_CODES if getattr(e, attr, None) is not None for c in codes]
+                    for i, e in enumerate(self._events.get(league, {}).values())}
+
+    def _match_words(self):
+        return [str(i + 1) for i in range(len(self.matches))]
 
     def _main_after_run(self):
-        json.dump(self.record, open('rec.bin', 'w'))
+        self.journal.sync()
+        self.history.sync()
+        if self.journal.due():
+            self._snapshot()
+
+    def _batch_before(self):
+        self.journal.lazy = True
+        self.interactive = False
+
+    def _batch_after_run(self):
+        # no prelude in batch mode, settle what is known at each flush
+        self._settle_pending()
+
+    def _batch_after(self):
+        # the results still loading would be lost with the process
+        self._results_ready.wait()
+        self._settle_pending()
 
     def _main_after(self):
-        json.dump(self.conf, open('conf.json', 'w'))
+        self._stop.set()
+        if self._refresh_worker is not None:
+            # let it leave before the interpreter shuts down under it
+            self._refresh_worker.join(5)
+        self._snapshot()
+        self.journal.close()
+        self.history.close()
+        if self._odds_from is None:
+            self._leagues.save()
+            json.dump(self.conf, open(self._file('conf.json'), 'w'))
+
+    @STATS.timed('persist.snapshot')
+    def _snapshot(self):
+        """
+        Fold the journal into rec.bin and log.json; each file remembers the last entry it contains
+        """
+        self.history.sync()
+        self.journal.sync()
+        self.logs['seq'] = self.record['seq'] = self.journal.seq
+        save_json(self.logs, self._file('log.json'))
+        save_json(self.record, self._file('rec.bin'))
+        self.journal.truncate()
+
+    def _commit(self, op, **kwargs):
+        """
+        Journal a state change then apply it
+        :param op: operation name, see _apply
+        """
+        entry = dict(kwargs, op=op)
+        self.journal.append(entry)
+        if entry.get('log'):
+            # the history store writes at once, so a lazy journal must not stay behind it
+            self.journal.flush()
+        self._apply(entry)
+        self.invalidate_completer()
+
+    @staticmethod
+    def _market_key(sube, mkey):
+        """
+        :return: key of a subevent dict under the event key mkey
+        """
+        return _sdict[sube['type']](**dict(sube, match_key=mkey, bets=[])).key()
+
+    def _rekey(self, entry, renamed):
+        """
+        Rename the legacy keys of a journal entry written by an older version
+        :param renamed: dict<old key, new key>, completed with the bets of the entry
+        """
+        if entry['op'] == 'bet' and legacy(entry['match']):
+            mkey = renamed.setdefault(entry['match'], event_key(entry['mdict']['teams'], entry['mdict']['match_time']))
+            renamed.setdefault(entry['sub'], self._market_key(entry['sdict'], mkey))
+            entry['sdict']['match_key'] = mkey
+        for field in ['match', 'sub']:
+            if field in entry:
+                entry[field] = renamed.get(entry[field], entry[field])
+        if entry.get('log', {}).get('match_key'):
+            entry['log']['match_key'] = renamed.get(entry['log']['match_key'], entry['log']['match_key'])
+
+    def _apply(self, entry, record=True, logs=True, history=True):
+        """
+        Apply a journal entry on rec.bin (record), log.json (logs) and / or the history store
+        """
+        op = entry['op']
+        if op == 'balance':
+            if record:
+                self.record['balance'] += entry['delta']
+            if history and entry.get('log'):
+                self.history.append(entry['log'], entry['seq'])
+        elif op == 'bet':
+            if record:
+                if entry['match'] not in self.matches:
+                    self.matches[entry['match']] = entry['mdict']
+                    self._match_ids = None
+                if entry['sub'] not in self.subevents:
+                    self._sub_count[entry['sdict']['match_key']] += 1
+                self.subevents.setdefault(entry['sub'], entry['sdict'])['bets'].append(entry['bet'])
+                self.record['balance'] -= entry['bet'][0]
+                if self._exposure is not None:
+                    self._exposure.add_bet(entry['sub'], self.subevents[entry['sub']], entry['bet'])
+        elif op == 'result':
+            if record and entry['match'] in self.matches:
+                self.matches[entry['match']]['result'] = entry['result']
+        elif op == 'unmatch':
+            if record and entry['match'] in self.matches:
+                self.matches[entry['match']]['unmatch'] = 'True'
+        elif op == 'settle':
+            if record and entry['sub'] in self.subevents:
+                mkey = self.subevents.pop(entry['sub'])['match_key']
+                if self._exposure is not None:
+                    self._exposure.remove(entry['sub'])
+                self.record['balance'] += entry['got']
+                self._sub_count[mkey] -= 1
+                if self._sub_count[mkey] <= 0:
+                    del self._sub_count[mkey]
+                    self.matches.pop(mkey, None)
+                    self._match_ids = None
+            if history:
+                self.history.append(entry['log'], entry['seq'])
+        elif op == 'alias':
+            if logs:
+                self._aliases.learn(entry['id'], entry['theirs'], entry['ours'])
+
+    def _matchIds(self):
+        """
+        :return: Numbering of the bet matches as printMatches lists them
+        """
+        if self._match_ids is None:
+            self._match_ids = Numbering(sorted(self.matches.keys()))
+        return self._match_ids
 
     def _keep(self, key):
-        for p in self.conf['pref']:
-            if key.startswith(p):
-                return True
-        for r in self.repat:
-            if r.match(key):
-                return True
-        return False
+        return self._leagues.keep(key)
+
+    def _iter_events(self, fin):
+        """
+        Stream the odds feed and yield only the events we care about
+        :param fin: file-like object of the Pinnacle xml feed
+        :return: generator of (league, event node); nodes are cleared once consumed
+        """
+        kept = dropped = 0
+        # only the end of an event matters, sporttype and league are read from the complete node
+        for _, elem in ET.iterparse(fin):
+            if elem.tag != 'event':
+                continue
+            league = elem.findtext('league')
+            if league is not None and (elem.findtext('sporttype') or '').startswith('Soccer') and self._keep(league):
+                kept += 1
+                yield league, elem
+            else:
+                dropped += 1
+            elem.clear()
+        STATS.count('events.kept', kept)
+        STATS.count('events.dropped', dropped)
+
+    @staticmethod
+    def _event(e):
+        """
+        :param e: event node of the odds feed
+        :return: BetEvent of the match period, None when the match is not offered
+        """
+        periods = e.find('periods')
+        if periods is None:
+            return None
+        opens = [p for p in periods if (p.findtext('period_description') or ' ').lower()[0] == 'm']
+        if not len(opens):
+            return None
+        teams = sorted({p.findtext('visiting_home_draw'): p.findtext('participant_name')
+                        for p in list(e.find('participants'))[:2]}.items())
+        return BetEvent(
+            teams_rel=[p[1] for p in teams],
+            ddl=datetime.strptime(e.findtext('event_datetimeGMT'), '%Y-%m-%d %H:%M'),
+            opens=opens[0])
+
+    @STATS.timed('odds.parse')
+    def _parse_bets(self, fin):
+        """
+        :param fin: file-like object of the Pinnacle xml feed
+        :return: dict<league, OrderedDict<event key, BetEvent>> sorted by kick off
+        """
+        events = {}
+        for league, e in self._iter_events(fin):
+            evt = self._event(e)
+            if evt is not None:
+                # TODO: set up different way of checking result
+                events.setdefault(league, {})[evt.key()] = evt
+        for k in events.keys():
+            events[k] = OrderedDict(sorted(events[k].items(), key=lambda t: t[1]))
+        return events
 
     def _pull_bets(self):
         tick = TickTock()
-        print "Connecting the Server for Odds...",
-        req = urllib2.Request('http://xml.pinnaclesports.com/')
-        fin = urllib2.urlopen(req)
-        tick.ptime()
+        fin = self._odds.fetch()
+        fetched = tick.fmt('fetch {:.2f} s ({})', lambda td: (td.total_seconds(), self._odds.status))
         tick = TickTock()
-        print "Parsing Bet data...",
-        catag = {}
-        for e in ET.parse(fin).getroot().find('events'):
-            if not e.find('sporttype').text.startswith('Soccer') or e.find('periods') is None or not len(e.find('periods')):
-                continue
-            league = e.find('league').text
-            if league not in catag:
-                catag[league] = []
-            catag[league].append(e)
-        tick.ptime()
+        events = self._parse_bets(fin)
+        fin.close()
+        with self._evlock:
+            self._events = events
+            self._evindex.rebuild(events)
+        self.invalidate_completer()
+        self._odds_history.record(events, self._odds.meta.get('time'))
+        self._stages['Odds'] = '{}, parse {}'.format(fetched, tick.fmt())
+
+    def _refresher(self):
+        """
+        Background loop refreshing the odds every refresh_every seconds
+        """
+        self._bets_ready.wait()
+        while not self._stop.wait(self.conf.get('refresh_every', self._odds.ttl)):
+            try:
+                self._refresh()
+            except Exception, err:
+                self._stages['Refresh'] = 'failed ({})'.format(err)
+
+    def _refresh(self, force=False):
+        """
+        Pull the feed again and merge it into the current events
+        :param force: ask the server even within the freshness window
+        :return: (added, changed, removed) events
+        """
         tick = TickTock()
-        print "Filteration ...",
-        for k,v in catag.items():
-            if not self._keep(k):
-                continue
-            if k not in self._events:
-                self._events[k] = {}
-            for e in v:
-                opens = [p for p in e.find('periods') if p.find('period_description').text.lower()[0] == 'm']
-                if not len(opens):
-                    continue
-                teams = sorted({p.find('visiting_home_draw').text: p.find('participant_name').text
-                        for p in list(e.find('participants'))[:2]}.items())
-                # TODO: UPDATE so that refreshable
-                evt = BetEvent(
-                    teams_rel=[p[1] for p in teams],
-                    ddl=datetime.strptime(e.find('event_datetimeGMT').text, '%Y-%m-%d %H:%M'),
-                    opens=opens[0])
-                # TODO: set up different way of checking result
-                self._events[k][evt.key()] = evt
-            self._events[k] = OrderedDict(sorted(self._events[k].items(), key=lambda t: t[1]))
-        tick.ptime()
+        with self._refresh_lock:
+            fin = self._odds.fetch(force)
+            fresh = self._odds.status == 'downloaded' and self._parse_bets(fin) or None
+            fin.close()
+            if fresh is not None:
+                self._odds_history.record(fresh, self._odds.meta.get('time'))
+            counts = self._merge_events(fresh)
+        self._stages['Refresh'] = tick.fmt('{:.2f} s ({}), +{} ~{} -{}',
+                                           lambda td: (td.total_seconds(), self._odds.status) + counts)
+        return counts
 
-    def _pull_results(self):
-        if not len(self.matches):
+    def _merge_events(self, fresh):
+        """
+        Update self._events in place: new events are inserted at their sorted position, changed markets
+        are replaced and events gone from the feed or past their deadline are removed
+        :param fresh: events from _parse_bets, None to only drop the expired ones
+        :return: (added, changed, removed)
+        """
+        added = changed = removed = 0
+        moved = set()
+        now = _gmtNow()
+        with self._evlock:
+            for league, events in (fresh or {}).items():
+                current = self._events.setdefault(league, OrderedDict())
+                for key, evt in events.items():
+                    if key not in current:
+                        _insort(current, key, evt)
+                        added += 1
+                        moved.add(league)
+                    elif current[key].update(evt):
+                        changed += 1
+            for league, current in self._events.items():
+                gone = [k for k, e in current.items()
+                        if e.deadline <= now or (fresh is not None and k not in fresh.get(league, {}))]
+                for k in gone:
+                    del current[k]
+                    moved.add(league)
+                removed += len(gone)
+                if not len(current):
+                    del self._events[league]
+                    if self._currlg == league:
+                        self._currlg = None
+                        self._doprint = False
+            if moved:
+                self._evindex.rebuild(self._events, moved)
+        if added or changed or removed:
+            self.invalidate_completer()
+        return added, changed, removed
+
+    def _pull_results(self, matches):
+        """
+        Download finished fixtures around the pending matches, run in background
+        :param matches: snapshot of self.matches without the unmatchable ones
+        """
+        if not len(matches):
+            self._stages['Results'] = 'nothing pending'
             return
 
         # TODO: PLAN B - blacklist on event
         tick = TickTock()
-        print 'Preparing match details...',
-        matches = {k:dict(m) for k,m in self.matches.items() if 'unmatch' not in m}
+        oldest = min([datetime.strptime(m['match_time'], _DATE_FORMAT).date() for m in matches.values()])
+        days = max(0, (_gmtNow().date() - oldest).days)
+        days = min(days + 1, 99)
+        with STATS.timer('results.sync'):
+            fetched, errors = self._fixture_store.sync(self._fixture_client, days)
+        fixtures = self._fixture_store.finished(oldest)
+        self._stages['Results'] = tick.fmt('{:.2f} s, {} fetched, {} finished{}',
+                                           lambda td: (td.total_seconds(), fetched, len(fixtures),
+                                                       errors and ', %d request(s) fail: %s' % (len(errors), errors[0]) or ''))
+        self._fixtures = fixtures
+
+    def _match_results(self, fixtures):
+        """
+        Match downloaded fixtures with our pending matches, may ask the user
+        :param fixtures: finished fixtures from football-data
+        """
+        if not len(fixtures):
+            return
+        matches = {k:dict(m) for k,m in self.matches.items() if 'unmatch' not in m and 'result' not in m}
         for m in matches.values():
             m['match_time'] = datetime.strptime(m['match_time'], _DATE_FORMAT)
-            m['match_date'] = m['match_time'].date()
-            m['homeVector'] = _toUniCounter(m['teams'][0])
-            m['awayVector'] = _toUniCounter(m['teams'][1])
+        care_times = {m['match_time'] for m in matches.values()}
 
-        days = max(0, *[(_gmtNow().date() - m['match_date']).days for m in matches.values()])
-        days = min(days + 1, 99)
-        tick.ptime()
-        print 'Parsing fixtures...'
-        hdr = {'X-Auth-Token': None,'X-Response-Control': 'minified'}
-        prev = unirest.get('http://api.football-data.org/v1/fixtures?timeFrame=p{}'.format(days), header=hdr).body
-        nxt =  unirest.get('http://api.football-data.org/v1/fixtures?timeFrame=n1', header=hdr).body
-        if 'fixtures' not in prev:
-            print 'Request 1 Fails!'
-            print prev['error']
-            prev = []
-        else:
-            prev = prev['fixtures']
-        if 'fixtures' not in nxt:
-            print 'Request 2 Fails!'
-            print nxt
-        else:
-            nxt = nxt['fixtures']
-        fixtures = [f for f in prev + nxt if f['status'].lower() == 'finished']
-        if not len(fixtures):
-            print 'No fixture data found...'
+        fxdict = by_kickoff(fixtures, care_times)
+        if not len(fxdict):
             return
 
-        # TODO: MATCHING FIXTURES
-        fxdict = {}
-        for f in fixtures:
-
-            # 1st try - team id match + key match
-
-            mtime = datetime.strptime(f['date'], '%Y-%m-%dT%H:%M:%SZ')
-            f['homeid'] = home = f['_links']['homeTeam']['href'][f['_links']['homeTeam']['href'].rfind('/')+1:]
-            f['awayid'] = away = f['_links']['awayTeam']['href'][f['_links']['awayTeam']['href'].rfind('/')+1:]
-            if home in self.knowledge and away in self.knowledge:
-                key = BetEvent._timekey(mtime) + BetEvent._teamkey([self.knowledge[home][1], self.knowledge[away][1]])
-                if key in matches:
-                    self.matches[key]['result'] = (f['result']['goalsHomeTeam'], f['result']['goalsAwayTeam'])
-                    print '\tReceives {0[0]} {0[1]}-{1[1]} {1[0]}'.format(*zip(self.matches[key]['teams'], self.matches[key]['result']))
-                    continue
-
-            # 2nd try pep - catg by time
-
-            f['homeVector'] = _toUniCounter(f['homeTeamName'])
-            f['awayVector'] = _toUniCounter(f['awayTeamName'])
-            if mtime not in fxdict:
-                fxdict[mtime] = []
-            fxdict[mtime].append(f)
-        print 'Matching trail...'
-        unknown_results = {k:m for k,m in matches.items() if 'result' not in self.matches[k]}
-        care_times = {m['match_time'] for m in unknown_results.values()}
-        fxdict = {k: v for k,v in fxdict.items() if k in care_times}
-        for k,m in unknown_results.items():
-            if m['match_time'] not in fxdict:
+        matcher = FixtureMatcher(fxdict, self._aliases, accept=self.conf.get('match_accept', 0.85))
+        ask = self.interactive and self.conf.get('match_ask', True)
+        for k, m in sorted(matches.items()):
+
+            # 1st try - both teams are known aliases
+
+            best_match = matcher.known(m['match_time'], m['teams'])
+            if best_match is not None:
+                self._setResult(k, best_match)
+                continue
+
+            # 2nd try - n-gram similarity of fixtures at the same time
+
+            best_match_s = matcher.candidates(m['match_time'], m['teams'])
+            best_match = matcher.auto(best_match_s)
+            if best_match is not None:
+                self._learnAlias(m, best_match)
+                self._setResult(k, best_match)
+                continue
+            if not ask:
                 continue
-            best_match_s = sorted(fxdict[m['match_time']],
-                                key=lambda x: _cosine(m['homeVector'], x['homeVector']) * _cosine(m['awayVector'], x['awayVector']),
-                                  reverse=True)[:5]
-            for best_match in best_match_s:
+            for score, best_match in best_match_s:
                 print '\tMatching "{} - {}"'.format(*m['teams']),
-                print 'with "%s - %s"' % (best_match['homeTeamName'], best_match['awayTeamName'])
-                selection = raw_input('\t\tAccept / Reject / Unmatchable:\t').lower()[0]
+                print 'with "%s - %s" (%.2f)' % (best_match['homeTeamName'], best_match['awayTeamName'], score)
+                selection = (raw_input('\t\tAccept / Reject / Unmatchable:\t').lower() or 'r')[0]
                 if selection in 'ay':
-                    self.knowledge[best_match['homeid']] = (best_match['homeTeamName'], m['teams'][0])
-                    self.knowledge[best_match['awayid']] = (best_match['awayTeamName'], m['teams'][1])
-                    self.matches[k]['result'] = (best_match['result']['goalsHomeTeam'], best_match['result']['goalsAwayTeam'])
+                    self._learnAlias(m, best_match)
+                    self._setResult(k, best_match)
                     break
                 elif selection == 'u':
                     ###
@@ -251,42 +629,43 @@ class MainMenu(AbstractCompleteMenu):
                     # self.knowledge['unmatch'].extend(m['teams'])
                     #
                     # TODO: When save matches, set up unmatch flag to matches - plan B
-                    self.matches[k]['unmatch'] = 'True'
+                    self._commit('unmatch', match=k)
                     break
-        self._saveLog()
 
-    def _saveLog(self):
-        json.dump(self.logs, open('log.json', 'w'))
+    def _learnAlias(self, match, fixture):
+        self._commit('alias', id=fixture['homeid'], theirs=fixture['homeTeamName'], ours=match['teams'][0])
+        self._commit('alias', id=fixture['awayid'], theirs=fixture['awayTeamName'], ours=match['teams'][1])
+
+    def _setResult(self, key, fixture):
+        self._commit('result', match=key, result=(fixture['result']['goalsHomeTeam'], fixture['result']['goalsAwayTeam']))
+        print '\tReceives {0[0]} {0[1]}-{1[1]} {1[0]}'.format(*zip(self.matches[key]['teams'], self.matches[key]['result']))
 
     def _execute_results(self):
-        revealed = []
-        for k,v in sorted(self.subevents.items(), lambda x, y: cmp(x[1]['match_time'], y[1]['match_time'])):
-            if v['match_key'] not in self.matches or 'result' not in self.matches[v['match_key']]:
-                continue
-            self._execute_onMatch(v, self.matches[v['match_key']])
-            revealed.append(k)
-        self.record['subevent'] = self.subevents = {k: v for k,v in self.subevents.items() if k not in revealed}
-        care_key = {s['match_key'] for s in self.subevents.values()}
-        self.record['match'] = self.matches = {k: v for k,v in self.matches.items() if k in care_key}
-        self._saveLog()
-
-    def _execute_onMatch(self, sube, match):
-        s_sube = _sdict[sube['type']](**sube)   # create a _Mline/Sprd/Total_ based on dict
-        got = s_sube.execute(match['result'])
-        self.logs['bet_logs'].append(
-            {'match': '{1[0]} {1[1]} - {2[1]} {2[0]} ({0})'.format(sube['type'], *zip(match['teams'], match['result'])),
-             'date': match['match_time'],
-             'total_get': got,
-             'total_spend': s_sube.total_bet,
-             'bets': s_sube.bet_details()})
-        self.record['balance'] += got
+        results = {k: m['result'] for k, m in self.matches.items() if 'result' in m}
+        if not len(results):
+            return
+        with STATS.timer('settle'):
+            gots = settle(self.subevents, results)
+            for k, v in sorted([(k, self.subevents[k]) for k in gots], key=lambda t: t[1]['match_time']):
+                self._commit('settle', sub=k, got=gots[k], log=self._settle_log(v, self.matches[v['match_key']], gots[k]))
+        STATS.count('settle.subevents', len(gots))
+
+    def _settle_log(self, sube, match, got):
+        """
+        :return: bet log entry of a settled subevent
+        """
+        return {'match': '{1[0]} {1[1]} - {2[1]} {2[0]} ({0})'.format(sube['type'], *zip(match['teams'], match['result'])),
+                'date': match['match_time'],
+                'match_key': sube['match_key'],
+                'total_get': got,
+                'total_spend': sum([t[0] for t in sube['bets']]),
+                'bets': _sdict[sube['type']].details(sube['odds'], sube['bets'])}
 
     def _getLeagueKey(self, league):
         if league.isdigit():
-            try:
-                league = sorted(self._events.keys())[abs(int(league) - 1)]
-            except:
-                print 'ERROR: index {} is out of bound'.format(league)
+            num, league = league, self._evindex.league(league)
+            if league is None:
+                print 'ERROR: index {} is out of bound'.format(num)
                 return
         else:
             league = league.replace('_', ' ')
@@ -296,22 +675,29 @@ class MainMenu(AbstractCompleteMenu):
         return league
 
     def chooseLeague(self, league, *args):
+        self._wait_bets()
         if league == '..':
             self._currlg = None
             self._doprint = False
+            self.invalidate_completer()
             print 'Un-select the league'
             return
         league = self._getLeagueKey(league)
         if league is not None:
             self._currlg = league
+            self.invalidate_completer()
             self._doprint = not (len(args) and args[0].startswith('--no') )
 
     def printLeagues(self, *args):
+        self._wait_bets()
         print 'Current Leagues: '
-        for i, l in enumerate(sorted(self._events.keys())):
+        with self._evlock:
+            leagues = sorted(self._events.keys())
+        for i, l in enumerate(leagues):
             print '{:2>d} {}'.format(i + 1, l)
 
     def showEvents(self, *args):
+        self._wait_bets()
         if not len(args) and self._currlg is not None:
             league = self._currlg
         else:
@@ -322,11 +708,18 @@ class MainMenu(AbstractCompleteMenu):
                 return
         if league is None:
             return
-        teaml = max([len(e) for e in self._events[league].values()])
-        print ' ' * (teaml + 2), '    '.join(['{:^{l}}'.format(t, l=l)
-                                              for t,l in zip(['Moneyline','Spread','Total'], [19,26,22])])
-        for i, e in enumerate(self._events[league].values()):
-            print u'{:>2} {:<{namelen}}'.format(i+1, e.name(), namelen=teaml), str(e), '   in', _pdtime(e.deadline - _gmtNow())
+        with self._evlock:
+            events = self._events.get(league, {}).values()
+        if not len(events):
+            print 'No event left in "{}".'.format(league)
+            return
+        # market columns are cached by the events, only the countdown is computed here
+        now = _gmtNow()
+        teaml = max([len(e) for e in events])
+        lines = [' ' * (teaml + 3) + _EVENTS_HEADER]
+        lines.extend([u'{:>2} {:<{namelen}} {}    in {}'.format(i+1, e.name(), str(e), _pdtime(e.deadline - now), namelen=teaml)
+                      for i, e in enumerate(events)])
+        print u'\n'.join(lines)
 
     @staticmethod
     def _parse_option(option):
@@ -349,6 +742,7 @@ class MainMenu(AbstractCompleteMenu):
         return None, None
 
     def betOn(self, *args):
+        self._wait_bets()
         if len(args) == 4:
             self._betOn(self._getLeagueKey(args[0]), *args[1:])
         elif len(args) == 3 and self._currlg is not None:
@@ -367,41 +761,36 @@ class MainMenu(AbstractCompleteMenu):
         """
         if league is None:
             return
-        if not mnum.isdigit() or int(mnum) <= 0:
-            print 'ERROR: Match number %d does not exist' % mnum
-            return
         try:
             bet = float(bet)
             assert 0 < bet <= self.record['balance']
         except:
             print 'ERROR: Invalid bet %s' % bet
             return
-        try:
-            event = self._events[league].values()[int(mnum) - 1]
-        except:
-            print 'ERROR: Match number %s does not exist' % mnum
-            return
+        with self._evlock:
+            key = self._evindex.event(league, mnum)
+            if key is None:
+                print 'ERROR: Match number %s does not exist' % mnum
+                return
+            event = self._events[league][key]
 
-        opt, sub = MainMenu._parse_option(option)
-        if opt is None or sub is None:
-            return
-        try:
-            beton = getattr(event, opt)
-        except:
-            print 'ERROR: Sub option "%s" is not available currently' % opt
-            return
+            opt, sub = MainMenu._parse_option(option)
+            if opt is None or sub is None:
+                return
+            try:
+                beton = getattr(event, opt)
+            except:
+                print 'ERROR: Sub option "%s" is not available currently' % opt
+                return
 
-        print 'Bet {} on event "{}" with option "{}": \n\t{}'.format(bet, event.name(), option, str(event))
-        # beton.doBet(bet, sub)
-        if event.key() not in self.matches:
-            self.matches[event.key()] = event.toDict()
-        if beton.key() not in self.subevents:
-            self.subevents[beton.key()] = beton.toDict()
-        betd = self.subevents[beton.key()]['bets'].append((bet, sub))
-        self.record['balance'] -= bet
+            print 'Bet {} on event "{}" with option "{}": \n\t{}'.format(bet, event.name(), option, str(event))
+            # beton.doBet(bet, sub)
+            self._commit('bet', match=event.key(), mdict=event.toDict(),
+                         sub=beton.key(), sdict=dict(beton.toDict(), bets=[]), bet=(bet, sub))
 
     def printMatches(self, *args):
-        for i, (k, m) in enumerate(sorted(self.matches.items())):
+        for i, k in enumerate(self._matchIds()):
+            m = self.matches[k]
             t = datetime.strptime(m['match_time'], _DATE_FORMAT) - _HourDiff
             print '{:>2d} {}  {} - {}'.format(i+1, t, *m['teams'])
 
@@ -412,12 +801,18 @@ class MainMenu(AbstractCompleteMenu):
                 print '{:>8}bet {} on {}'.format(' ', *itm)
 
     def printBetHistory(self, *args):
-        if len(args) and args[0].isdigit():
-            last_entry = int(args[0])
+        if len(args) and args[0] == '-m':
+            num = len(args) > 1 and args[1] or ''
+            entry = num.isdigit() and self.history.entry(int(num) - 1) or None
+            if entry is None or not entry.get('match_key'):
+                print 'ERROR: History entry "%s" is not a settled bet' % num
+                return
+            first, entries = 0, self.history.of_match(entry['match_key'])
+        elif len(args) and re.match('\d{4}-\d{2}', args[0]):
+            first, entries = 0, self.history.between(args[0], len(args) > 1 and args[1] or '9999')
         else:
-            last_entry = 10
-        first = max(len(self.logs['bet_logs']) - last_entry, 0)
-        for i, s in enumerate(self.logs['bet_logs'][first:]):
+            first, entries = self.history.last(len(args) and args[0].isdigit() and int(args[0]) or 10)
+        for i, s in enumerate(entries):
             print '{:>3d} {} {:+} {}'.format(i+first+1, s['date'][:10], s['total_get'] - s['total_spend'], s['match'])
             for itm in s['bets']:
                 print '{:>8}bet {} on {}'.format(' ', *itm)
@@ -428,15 +823,14 @@ class MainMenu(AbstractCompleteMenu):
         except:
             print 'ERROR: "%s" is not convertible to numbers.'
             return
-        self.logs['bet_logs'].append({'date': datetime.now().strftime(_DATE_FORMAT), 'bets': [],
-                                      'total_get': money, 'total_spend': 0, 'match': 'Issue new money'})
-        self.record['balance'] += money
+        self._commit('balance', delta=money,
+                     log={'date': datetime.now().strftime(_DATE_FORMAT), 'bets': [],
+                          'total_get': money, 'total_spend': 0, 'match': 'Issue new money'})
 
     def applyResult(self, mnum, result, *args):
-        try:
-            event = self.matches.values()[int(mnum) - 1]
-        except:
-            print 'ERROR: Match number %d does not exist' % mnum
+        key = self._matchIds().key(mnum)
+        if key is None:
+            print 'ERROR: Match number %s does not exist' % mnum
             return
 
         try:
@@ -450,11 +844,252 @@ class MainMenu(AbstractCompleteMenu):
         except:
             print 'ERROR: Result "%s" is not understandable' % result
             return
-        event['result'] = rslt
+        self._commit('result', match=key, result=rslt)
+
+    def exposure(self, *args):
+        pending = self._exposure.matches()
+        keys = [k for k in self._matchIds() if k in pending]
+        if not len(keys):
+            print 'No pending bets.'
+            return
+        prob = poisson_grid(*self.conf.get('goal_rates', [1.4, 1.1]), goals=self._exposure.goals)
+        if len(args) and args[0].isdigit():
+            try:
+                key = self._matchIds().key(args[0])
+                pnl = self._exposure.matrix(key)
+            except:
+                print 'ERROR: Match number %s has no pending bets' % args[0]
+                return
+            print '{} - {}  (home goals down, away goals across)'.format(*self.matches[key]['teams'])
+            print '   ' + ''.join(['{:>9d}'.format(a) for a in range(self._exposure.goals)])
+            for h, row in enumerate(pnl):
+                print '{:>2d} '.format(h) + ''.join(['{:>+9.1f}'.format(v) for v in row])
+            return
+        for k in keys:
+            worst, ws = self._exposure.worst(k)
+            best, bs = self._exposure.best(k)
+            ev, var = self._exposure.expected(k, prob)
+            print '{:>2d} {} - {}'.format(self._matchIds().number(k), *self.matches[k]['teams'])
+            print '{:>8}worst {:+.2f} ({}-{})  best {:+.2f} ({}-{})  expected {:+.2f} (sd {:.2f})'.format(
+                ' ', worst, ws[0], ws[1], best, bs[0], bs[1], ev, math.sqrt(max(var, 0)))
+        print 'Worst case over all matches: {:+.2f}'.format(self._exposure.total_worst())
+
+    def _market_odds(self, mkey):
+        """
+        Latest moneyline and total odds of a bet match: from the feed while it is listed, then from the odds history,
+        then from the bets themselves
+        :return: (moneyline odds or None, (line, over, under) or None, where they come from)
+        """
+        where = self._evindex.locate(mkey)
+        evt = None
+        if where is not None:
+            with self._evlock:
+                evt = self._events.get(where[0], {}).get(mkey)
+        if evt is not None:
+            ml, tg = getattr(evt, 'moneyline', None), getattr(evt, 'total', None)
+            return ml and list(ml.odds), tg and (tg.goalnum,) + tuple(tg._odds), 'feed'
+        series = self._odds_history.series(mkey)
+        if 'moneyline' in series or 'total' in series:
+            ml = 'moneyline' in series and [float(o) for o in series['moneyline']['odds'][-1]] or None
+            tg = 'total' in series and (float(series['total']['line'][-1]),) + tuple(
+                [float(o) for o in series['total']['odds'][-1][:2]]) or None
+            return ml, tg, 'history'
+        subs = [s for s in self.subevents.values() if s['match_key'] == mkey]
+        ml = ([s['odds'] for s in subs if s['type'] == 'Moneyline'] or [None])[0]
+        tg = ([(s['odds'][0],) + tuple(s['odds'][1]) for s in subs if s['type'] == 'TotalGoals'] or [None])[0]
+        return ml, tg, (ml or tg) and 'bets' or 'default'
+
+    def price(self, *args):
+        pending = self._exposure.matches()
+        keys = [k for k in self._matchIds() if k in pending]
+        if not len(keys):
+            print 'No pending bets.'
+            return
+        sims = len(args) and args[0].isdigit() and int(args[0]) or 0
+        prior = tuple(self.conf.get('goal_rates', [1.4, 1.1]))
+        tick = TickTock()
+        jobs, sources = [], {}
+        for k in keys:
+            ml, tg, sources[k] = self._market_odds(k)
+            jobs.append((k, ml, tg, prior, self._exposure.goals))
+        rates = Pricing.fit_many(jobs)
+        res = Pricing.price(self._exposure, rates, sims)
+        for k in keys:
+            ev, var = res['matches'][k]
+            print '{:>2d} {} - {}'.format(self._matchIds().number(k), *self.matches[k]['teams'])
+            print '{:>8}goal rates {:.2f} - {:.2f} ({})  expected {:+.2f} (sd {:.2f})'.format(
+                ' ', rates[k][0], rates[k][1], sources[k], ev, math.sqrt(max(var, 0)))
+        print 'All pending bets: expected {:+.2f} (sd {:.2f})'.format(res['ev'], math.sqrt(max(res['var'], 0)))
+        if sims:
+            s = res['samples']
+            print 'Simulated {} rounds: mean {:+.2f}, 5% quantile {:+.2f}, loss probability {:.1%}'.format(
+                sims, s.mean(), np.percentile(s, 5), (s < 0).mean())
+        print 'Priced in {}'.format(tick.fmt('{:.3f} s'))
+
+    def refresh(self, *args):
+        self._wait_bets()
+        # shared odds are refreshed by their owner, with its own league filter
+        owner = self._odds_from or self
+        try:
+            counts = owner._refresh(force=True)
+        except Exception, err:
+            print 'ERROR: Cannot refresh the odds ({}), the current ones are kept.'.format(err)
+            return
+        print 'Added {}, changed {}, removed {} events.'.format(*counts)
+        if owner is not self:
+            self.invalidate_completer()
+
+    def scan(self, *args):
+        self._wait_bets()
+        k = ([int(a) for a in args if a.isdigit()] or [10])[0]
+        by = 'move' in args and 'move' or 'margin'
+        tick = TickTock()
+        with self._evlock:
+            res = Scan.scan(self._events, self._odds_history, k, by)
+        if not len(res['top']):
+            print 'No market to scan.'
+            return
+        print 'Scanned {} markets of {} leagues in {}'.format(len(res['kind']), len(res['leagues']), tick.fmt('{:.3f} s'))
+        print '{:>3} {:<22} {:<36} {:<10} {:>6} {:<20} {:<12} {:>7} {:>6} {:>7}'.format(
+            '', 'League', 'Match', 'Market', 'Line', 'Odds', 'Implied %', 'Margin', 'z', 'Move')
+        for rank, i in enumerate(res['top']):
+            have = ~np.isnan(res['odds'][i])
+            print u'{:>3} {:<22.22} {:<36.36} {:<10} {:>6} {:<20} {:<12} {:>6.2f}% {:>+6.1f} {:>7}'.format(
+                rank + 1, res['leagues'][res['league'][i]], res['name'][i], Scan.market_name(res['kind'][i]),
+                res['kind'][i] and '{:+g}'.format(res['line'][i]) or '',
+                '/'.join(['{:.3f}'.format(o) for o in res['odds'][i][have]]),
+                '/'.join(['{:.0f}'.format(p * 100) for p in res['prob'][i][have]]),
+                res['margin'][i] * 100, res['z'][i],
+                not np.isnan(res['move'][i]) and '{:+.3f}'.format(res['move'][i]) or '-')
+
+    def _reload(self):
+        """
+        Parse the odds snapshot again after a watchlist change
+        """
+        self._wait_bets()
+        self.conf['pref'], self.conf['repat'] = self._leagues.pref, self._leagues.repat
+        if not self._odds.has_snapshot():
+            return
+        with open(self._odds.path, 'rb') as fin:
+            fresh = self._parse_bets(fin)
+        print 'Added {}, changed {}, removed {} events.'.format(*self._merge_events(fresh))
+
+    def _shared_leagues(self):
+        """
+        :return: True, with an error printed, when the odds and so the followed leagues belong to another menu
+        """
+        if self._odds_from is not None:
+            print 'ERROR: The leagues are shared by every account, change them in the conf.json of the server.'
+        return self._odds_from is not None
+
+    def watch(self, *args):
+        regex = len(args) and args[0] == '-r'
+        pattern = ' '.join(args[regex and 1 or 0:])
+        if not pattern:
+            print 'Prefixes:', ', '.join(['"{}"'.format(p) for p in self._leagues.pref])
+            print 'Patterns:', ', '.join(['"{}"'.format(r) for r in self._leagues.repat])
+            return
+        if self._shared_leagues():
+            return
+        try:
+            if not self._leagues.add(pattern, regex):
+                print '"{}" is followed already.'.format(pattern)
+                return
+        except re.error, err:
+            print 'ERROR: "{}" is not a valid pattern ({})'.format(pattern, err)
+            return
+        self._reload()
+
+    def unwatch(self, *args):
+        if self._shared_leagues():
+            return
+        pattern = ' '.join(args)
+        if not self._leagues.remove(pattern):
+            print 'ERROR: "{}" is not followed.'.format(pattern)
+            return
+        self._reload()
+
+    def stats(self, *args):
+        if len(args) and args[0] == 'reset':
+            STATS.reset()
+            print 'Stats cleared.'
+            return
+        if len(args) > 1 and args[0] == 'export':
+            print 'Wrote {} metrics to {}'.format(STATS.export(args[1]), args[1])
+            return
+        if not STATS.enabled:
+            print 'Stats are off, start with --stats or set "stats": true in conf.json'
+            return
+        counters, histograms = STATS.snapshot()
+        elapsed = max(time() - STATS.started, 1e-6)
+        print 'Recorded over {}'.format(_pdtime(timedelta(seconds=elapsed)).strip())
+        for name, v in sorted(counters.items()):
+            print '{:<20}{:>12}{:>12.1f}/s'.format(name, v, v / elapsed)
+        if len(histograms):
+            print '{:<20}{:>8}{:>12}{:>12}{:>12}{:>12}{:>12}'.format('', 'count', 'mean', 'p50', 'p90', 'max', 'total')
+        for name, h in sorted(histograms.items()):
+            print '{:<20}{:>8}{:>12.4g}{:>12.4g}{:>12.4g}{:>12.4g}{:>12.4g}'.format(
+                name, h['count'], h['mean'], h['p50'], h['p90'], h['max'], h['total'])
 
     def quit(self, *args):
         return 'Quit'
 
+def backtest(root, strategy, grid=None, bankroll=10000):
+    """
+    Replay the recorded odds of an account against the results of its stored fixtures, without fetching
+    :param root: account directory, as MainMenu
+    :param strategy: name of a strategy of the Backtest module
+    :param grid: json file of a list of strategy parameter dicts, the strategy defaults if None
+    """
+    path = lambda name: os.path.join(root, name)
+    try:
+        conf = json.load(open(path('conf.json'), 'r'))
+    except:
+        conf = {}
+    try:
+        knowledge = json.load(open(path('log.json'), 'r'))['knowledge']
+    except:
+        knowledge = {'unmatch': []}
+    history = OddsHistory(path('odds_history'))
+    results = Backtest.fixture_results(history, FixtureStore(path('fixtures.json')).fixtures.values(),
+                                       AliasIndex(knowledge), accept=conf.get('match_accept', 0.85))
+    print '{} of {} recorded events have a result'.format(len(results), len(history.events))
+    grid = grid and json.load(open(grid, 'r')) or [{}]
+    print '{:<30}{:>8}{:>12}{:>12}{:>8}{:>8}{:>12}'.format('params', 'bets', 'staked', 'profit', 'roi', 'hit', 'drawdown')
+    for params, st in Backtest.grid_search(history.root, results, getattr(Backtest, strategy), grid, bankroll=bankroll):
+        print '{:<30}{:>8}{:>12.2f}{:>12.2f}{:>8.1%}{:>8.1%}{:>12.2f}'.format(
+            json.dumps(params, sort_keys=True), st['bets'], st['staked'], st['profit'], st['roi'], st['hit_rate'],
+            st['max_drawdown'])
+
 if __name__ == '__main__':
-    baseline_init()
-    MainMenu().main_loop()
+    parser = argparse.ArgumentParser(description='Bet soccer events from the command line')
+    parser.add_argument('-b', '--batch', metavar='FILE',
+                        help='run the commands of FILE ("-" for stdin) instead of prompting')
+    parser.add_argument('--flush-every', type=int, default=0, metavar='N',
+                        help='in batch mode, persist every N commands (default: once at the end)')
+    parser.add_argument('--stats', action='store_true', help='record timers and counters, see the stats command')
+    parser.add_argument('--stats-export', metavar='FILE', help='record stats and append them to FILE as json lines on exit')
+    parser.add_argument('--serve', type=int, metavar='PORT',
+                        help='serve the accounts of the sub directories on a local port')
+    parser.add_argument('--connect', metavar='HOST:PORT', help='bet through a running server')
+    parser.add_argument('--user', default=os.environ.get('USER', 'default'), help='account used with --connect')
+    parser.add_argument('--backtest', metavar='STRATEGY', nargs='?', const='favourite',
+                        help='replay the recorded odds against the stored results with a strategy of Backtest.py')
+    parser.add_argument('--grid', metavar='FILE', help='json list of strategy parameter dicts for --backtest')
+    parser.add_argument('--bankroll', type=float, default=10000, help='starting balance of --backtest')
+    args = parser.parse_args()
+    STATS.enabled = args.stats or bool(args.stats_export)
+    if args.serve:
+        Service.serve(args.serve, lambda root, odds_from: MainMenu(root, odds_from))
+    elif args.backtest:
+        backtest('.', args.backtest, args.grid, args.bankroll)
+    elif args.connect:
+        baseline_init()
+        Service.client(args.connect, args.user)
+    elif args.batch:
+        MainMenu().batch_loop(args.batch == '-' and sys.stdin or open(args.batch, 'r'), args.flush_every)
+    else:
+        baseline_init()
+        MainMenu().main_loop()
+    if args.stats_export:
+        STATS.export(args.stats_export)
@@ -12,7 +12,8 @@ if [ $# -ge 1 ]; then
 		echo Welcome $1
 	fi
 	cd $1
+	shift
 fi
 
-python $CODE
+python $CODE "$@"
 cd $DIR